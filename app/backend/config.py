@@ -0,0 +1,5 @@
+import os
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SLIDES_DIR = Path(os.environ.get("WSI_SLIDES_DIR", BASE_DIR / "slides"))
@@ -0,0 +1,172 @@
+import io
+import math
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from backend.slide_cache import registry, LIMIT_BOUNDS
+from backend.tissue import background_color
+
+EXPORT_CHUNK = 2048
+MAX_EXPORT_PIXELS = int(os.environ.get("WSI_MAX_EXPORT_PIXELS", 64_000_000))
+MAX_EXPORT_REGIONS = int(os.environ.get("WSI_MAX_EXPORT_REGIONS", 50))
+EXPORT_INFLIGHT = int(os.environ.get("WSI_EXPORT_INFLIGHT", 2))
+EXPORT_WORKERS = int(os.environ.get("WSI_EXPORT_WORKERS", max(1, (os.cpu_count() or 4) // 2)))
+EXPORT_FORMATS = {"jpeg": ("JPEG", "jpg"), "png": ("PNG", "png")}
+
+_executor = None
+
+
+class ExportError(ValueError):
+    pass
+
+
+def image_bounds(handle) -> tuple:
+    # Origin and size of the image the viewer sees, in level-0 pixels
+    width, height = handle.dz.level_dimensions[-1]
+    if not LIMIT_BOUNDS:
+        return 0, 0, width, height
+    props = handle.slide.properties
+    return int(props.get("openslide.bounds-x", 0)), int(props.get("openslide.bounds-y", 0)), width, height
+
+
+def view_to_region(view: dict, bounds: tuple) -> dict:
+    # OpenSeadragon viewport units are fractions of the image width
+    x0, y0, width, height = bounds
+    zoom = float(view.get("zoom", 1.0))
+    aspect = float(view.get("aspect", width / height))
+    if zoom <= 0 or aspect <= 0:
+        raise ExportError("zoom and aspect must be positive")
+    view_w = width / zoom
+    view_h = view_w / aspect
+    cx = x0 + float(view.get("center_x", 0.5)) * width
+    cy = y0 + float(view.get("center_y", 0.5 * height / width)) * width
+    return {
+        "x": cx - view_w / 2, "y": cy - view_h / 2, "width": view_w, "height": view_h,
+        "rotation": float(view.get("rotation", 0.0)),
+    }
+
+
+def canvas_size(width: float, height: float, rotation: float) -> tuple:
+    # Rotated views are rendered as the axis-aligned box around them, then rotated and cropped
+    theta = math.radians(rotation % 360)
+    cos, sin = abs(math.cos(theta)), abs(math.sin(theta))
+    return width * cos + height * sin, width * sin + height * cos
+
+
+def output_size(region: dict, max_size: int = None, downsample: float = None) -> tuple:
+    # Returns the pixel size and the downsample actually applied, which fitting may have raised
+    width, height = region["width"], region["height"]
+    if width <= 0 or height <= 0:
+        raise ExportError("Region must have a positive size")
+    # The whole canvas is held in memory while it is assembled and encoded, so
+    # MAX_EXPORT_PIXELS is what bounds a single render's memory
+    box_w, box_h = canvas_size(width, height, region.get("rotation", 0.0))
+    if downsample is None:
+        downsample = max(1.0, max(width, height) / float(max_size)) if max_size else 1.0
+        # Without an explicit downsample, oversized regions are scaled to fit instead of refused
+        downsample = max(downsample, math.sqrt(box_w * box_h / MAX_EXPORT_PIXELS))
+    elif float(downsample) <= 0:
+        raise ExportError("downsample must be positive")
+    downsample = float(downsample)
+    out_w, out_h = max(1, round(width / downsample)), max(1, round(height / downsample))
+    if (box_w / downsample) * (box_h / downsample) > MAX_EXPORT_PIXELS * 1.001:
+        raise ExportError(f"Region renders to {out_w}x{out_h}, over the {MAX_EXPORT_PIXELS} pixel limit")
+    return (out_w, out_h), downsample
+
+
+def read_scaled(slide, level: int, x: float, y: float, width: float, height: float, size: tuple, fill) -> Image:
+    # read_region takes a level-0 origin and a size in pixels of the chosen level
+    level_ds = slide.level_downsamples[level]
+    read_size = (max(1, math.ceil(width / level_ds)), max(1, math.ceil(height / level_ds)))
+    tile = slide.read_region((int(x), int(y)), level, read_size)
+    flat = Image.new("RGB", tile.size, fill)
+    flat.paste(tile, mask=tile.split()[3])
+    return flat.resize(size, Image.LANCZOS)
+
+
+def render_region(key, path, region: dict, size: tuple, fmt: str = "jpeg", quality: int = 90) -> bytes:
+    rotation = region.get("rotation", 0.0) % 360
+    out_w, out_h = size
+    x, y, width, height = region["x"], region["y"], region["width"], region["height"]
+    if rotation:
+        # Render the axis-aligned box around the rotated view, then rotate and crop back
+        box_w, box_h = canvas_size(width, height, rotation)
+        x, y = x + (width - box_w) / 2, y + (height - box_h) / 2
+        width, height = box_w, box_h
+        out_w, out_h = round(width * size[0] / region["width"]), round(height * size[1] / region["height"])
+
+    with registry.open(key, path) as handle:
+        slide = handle.slide
+        fill = background_color(slide)
+        downsample = width / out_w
+        level = slide.get_best_level_for_downsample(downsample)
+        image = Image.new("RGB", (out_w, out_h), fill)
+        # Assemble the output chunk by chunk so only one source read is held at a time
+        for oy in range(0, out_h, EXPORT_CHUNK):
+            for ox in range(0, out_w, EXPORT_CHUNK):
+                cw, ch = min(EXPORT_CHUNK, out_w - ox), min(EXPORT_CHUNK, out_h - oy)
+                chunk = read_scaled(
+                    slide, level, x + ox * downsample, y + oy * downsample,
+                    cw * downsample, ch * downsample, (cw, ch), fill,
+                )
+                image.paste(chunk, (ox, oy))
+
+    if rotation:
+        image = image.rotate(-rotation, resample=Image.BILINEAR, fillcolor=fill)
+        left, top = (out_w - size[0]) // 2, (out_h - size[1]) // 2
+        image = image.crop((left, top, left + size[0], top + size[1]))
+
+    pil_format, _ = EXPORT_FORMATS[fmt]
+    buf = io.BytesIO()
+    if pil_format == "JPEG":
+        image.save(buf, format=pil_format, quality=quality)
+    else:
+        image.save(buf, format=pil_format)
+    return buf.getvalue()
+
+
+def get_executor():
+    # Region renders take seconds, so they get their own workers instead of queueing ahead of tiles
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(EXPORT_WORKERS, thread_name_prefix="export")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+class ZipStream(io.RawIOBase):
+    """Write-only sink that lets zipfile emit an archive incrementally."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def open_zip(stream: ZipStream) -> zipfile.ZipFile:
+    # Rendered images are already compressed, so entries are stored as-is
+    return zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED)
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import shutil
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+from openslide import OpenSlide
+from sqlalchemy import update
+from sqlalchemy.future import select
+
+from db import Slide, IngestJob, AsyncSessionLocal
+from backend.slide_cache import registry
+from backend.config import SLIDES_DIR
+from backend.utils import extract_zip, check_disk_space
+from backend import pyramid, tissue, thumbnails, metrics, leases
+
+UPLOAD_DIR = SLIDES_DIR / ".uploads"
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+WRITE_CHUNK = 8 * 1024 * 1024
+
+ACTIVE_STATUSES = ("queued", "extracting")
+
+_jobs = {}
+
+logger = logging.getLogger(__name__)
+
+
+class OffsetMismatch(Exception):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, offset: int):
+        super().__init__(f"Upload exceeds its declared size at offset {offset}")
+        self.offset = offset
+
+
+def upload_path(job_id: str) -> Path:
+    return UPLOAD_DIR / f"{job_id}.zip"
+
+
+def staging_dir(job_id: str) -> Path:
+    return SLIDES_DIR / f".staging-{job_id}"
+
+
+def slide_name_for(filename: str) -> str:
+    return Path(filename).name.rsplit(".", 1)[0]
+
+
+def slide_dir_for(slide_name: str) -> Path:
+    # Dot names are reserved for .uploads, .staging-* and the tile store, and the
+    # directory is rmtree'd on re-upload, so anything escaping SLIDES_DIR is refused
+    if not slide_name or slide_name.startswith(".") or Path(slide_name).name != slide_name:
+        raise ValueError(f"Invalid slide name: {slide_name!r}")
+    slide_dir = SLIDES_DIR / slide_name
+    if not slide_dir.resolve().is_relative_to(SLIDES_DIR.resolve()):
+        raise ValueError(f"Invalid slide name: {slide_name!r}")
+    return slide_dir
+
+
+def current_offset(job_id: str) -> int:
+    path = upload_path(job_id)
+    return path.stat().st_size if path.exists() else 0
+
+
+async def write_stream(job_id: str, chunks, offset: int, limit: int = None) -> int:
+    # Appends an async byte stream to the upload file, batching writes off the event loop.
+    # Nothing past limit bytes is ever written, so an oversized request leaves the upload resumable
+    path = upload_path(job_id)
+    if offset != current_offset(job_id):
+        raise OffsetMismatch(current_offset(job_id))
+
+    with metrics.ingest_stage("upload"), metrics.stage("write"):
+        handle = await run_in_threadpool(open, path, "ab")
+        try:
+            buffer = bytearray()
+            received = 0
+            async for chunk in chunks:
+                received += len(chunk)
+                if limit is not None and received > limit:
+                    raise UploadTooLarge(offset + received - len(buffer) - len(chunk))
+                buffer += chunk
+                if len(buffer) >= WRITE_CHUNK:
+                    await run_in_threadpool(handle.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await run_in_threadpool(handle.write, bytes(buffer))
+        finally:
+            await run_in_threadpool(handle.close)
+    return current_offset(job_id)
+
+
+async def upload_file_chunks(file):
+    while chunk := await file.read(WRITE_CHUNK):
+        yield chunk
+
+
+async def update_job(job_id: str, **values):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(IngestJob, job_id)
+        if job is None:
+            return
+        for name, value in values.items():
+            setattr(job, name, value)
+        await db.commit()
+
+
+def build_preview(build, slide_path: Path):
+    # A missing mask or thumbnail only disables a fast path, so it never fails the ingest
+    try:
+        slide = OpenSlide(str(slide_path))
+        try:
+            return str(build(slide, slide_path))
+        finally:
+            slide.close()
+    except Exception:
+        logger.exception("Could not build %s for %s", build.__name__, slide_path)
+        return None
+
+
+def extract_slide(job_id: str, slide_name: str) -> tuple:
+    zip_path = upload_path(job_id)
+    staging = staging_dir(job_id)
+    try:
+        slide_dir = slide_dir_for(slide_name)
+        if staging.exists():
+            shutil.rmtree(staging)
+        staging.mkdir(parents=True)
+
+        metrics.INGEST_BYTES.observe(zip_path.stat().st_size)
+        with metrics.ingest_stage("disk_check"):
+            check_disk_space(zip_path, SLIDES_DIR)
+        with metrics.ingest_stage("extract"):
+            extract_zip(zip_path, staging)
+
+        mrxs_files = list(staging.glob("*.mrxs"))
+        if not mrxs_files:
+            raise ValueError("No .mrxs file found in archive")
+
+        # Swap the finished directory into place so a half-extracted slide is never served
+        registry.invalidate_dir(slide_dir)
+        if slide_dir.exists():
+            shutil.rmtree(slide_dir)
+        staging.rename(slide_dir)
+    except Exception:
+        # Failed ingests are not retried, so the partial tree and the archive would only leak disk
+        shutil.rmtree(staging, ignore_errors=True)
+        zip_path.unlink(missing_ok=True)
+        raise
+    zip_path.unlink()
+    return slide_dir, mrxs_files[0].name
+
+
+async def ingest_job(job_id: str):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(IngestJob, job_id)
+        if job is None:
+            return
+        slide_name = slide_name_for(job.filename)
+        pregenerate, all_levels = job.pregenerate, job.all_levels
+
+    try:
+        await update_job(job_id, status="extracting", error=None)
+        slide_dir, filename = await run_in_threadpool(extract_slide, job_id, slide_name)
+        with metrics.ingest_stage("tissue_mask"):
+            mask = await run_in_threadpool(build_preview, tissue.build_mask, slide_dir / filename)
+        with metrics.ingest_stage("thumbnail"):
+            thumbnail = await run_in_threadpool(build_preview, thumbnails.build_thumbnail, slide_dir / filename)
+
+        async with AsyncSessionLocal() as db:
+            slide = Slide(name=slide_name, path=str(slide_dir), filename=filename, tissue_mask=mask,
+                          thumbnail=thumbnail)
+            db.add(slide)
+            await db.commit()
+            await db.refresh(slide)
+        await update_job(job_id, status="done", slide_id=slide.id)
+
+        if pregenerate:
+            await pyramid.start_job(slide.id, all_levels)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        await update_job(job_id, status="failed", error=str(exc))
+
+
+async def run_ingest(job_id: str):
+    # Every worker process resumes jobs, so the lease decides which one extracts
+    try:
+        async with leases.hold(
+            IngestJob.lease_owner, IngestJob.lease_expires,
+            IngestJob.id == job_id, IngestJob.status.in_(ACTIVE_STATUSES),
+        ) as claimed:
+            if claimed:
+                await ingest_job(job_id)
+    finally:
+        _jobs.pop(job_id, None)
+
+
+def launch(job_id: str):
+    if job_id not in _jobs:
+        _jobs[job_id] = asyncio.create_task(run_ingest(job_id))
+    return _jobs[job_id]
+
+
+async def start_ingest(job_id: str) -> bool:
+    # Conditional so a /complete retried against another worker cannot queue the archive twice
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(IngestJob)
+            .where(
+                IngestJob.id == job_id,
+                IngestJob.status == "uploading",
+                leases.available(IngestJob.lease_owner, IngestJob.lease_expires),
+            )
+            .values(status="queued", received=current_offset(job_id))
+        )
+        await db.commit()
+    if result.rowcount == 0:
+        return False
+    launch(job_id)
+    return True
+
+
+async def resume_jobs():
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(IngestJob.id).where(
+                IngestJob.status.in_(ACTIVE_STATUSES),
+                leases.available(IngestJob.lease_owner, IngestJob.lease_expires),
+            )
+        )
+        job_ids = result.scalars().all()
+    for job_id in job_ids:
+        launch(job_id)
+
+
+def shutdown():
+    for task in _jobs.values():
+        task.cancel()
+
+
+def job_status(job: IngestJob) -> dict:
+    status = {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "size": job.size,
+        "received": job.received or 0,
+        "error": job.error,
+        "slide_uuid": None,
+        "viewer_url": None,
+    }
+    if job.slide is not None:
+        status["slide_uuid"] = job.slide.uuid
+        status["viewer_url"] = f"/viewer/{job.slide.uuid}/{job.slide.filename}"
+    return status
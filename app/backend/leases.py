@@ -0,0 +1,65 @@
+import asyncio
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, or_
+
+from db import AsyncSessionLocal
+
+LEASE_SECONDS = int(os.environ.get("WSI_JOB_LEASE_SECONDS", 60))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def available(owner, expires):
+    # A lease left behind by a crashed worker lapses on its own
+    return or_(owner.is_(None), expires.is_(None), expires < datetime.utcnow())
+
+
+async def _update(owner, where, values) -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(owner.class_).where(*where).values(values).execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    return result.rowcount
+
+
+async def claim(owner, expires, *where) -> bool:
+    """Take the lease on the row matching where; only one worker can succeed."""
+    until = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    return await _update(owner, (*where, available(owner, expires)), {owner: WORKER_ID, expires: until}) == 1
+
+
+async def renew(owner, expires, *where):
+    until = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    await _update(owner, (*where, owner == WORKER_ID), {expires: until})
+
+
+async def release(owner, expires, *where):
+    await _update(owner, (*where, owner == WORKER_ID), {owner: None, expires: None})
+
+
+async def heartbeat(owner, expires, where):
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        await renew(owner, expires, *where)
+
+
+@asynccontextmanager
+async def hold(owner, expires, key, *conditions):
+    """Claims the row identified by key and keeps the lease alive until the block exits.
+
+    Yields whether the claim succeeded; callers skip the work when another worker holds it.
+    """
+    if not await claim(owner, expires, key, *conditions):
+        yield False
+        return
+    renewer = asyncio.create_task(heartbeat(owner, expires, (key,)))
+    try:
+        yield True
+    finally:
+        renewer.cancel()
+        await release(owner, expires, key)
@@ -0,0 +1,283 @@
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+SERVER_TIMING = os.environ.get("WSI_SERVER_TIMING", "0") == "1"
+SERVER_TIMING_HEADER = "x-server-timing"
+PROFILE_SLOW_MS = float(os.environ.get("WSI_PROFILE_SLOW_MS", 0))
+PROFILE_DIR = Path(os.environ.get("WSI_PROFILE_DIR", "./profiles"))
+PROFILE_INTERVAL = 0.005
+LOOP_LAG_INTERVAL = 0.25
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e6, 1e7, 1e8, 1e9, 5e9, 1e10, 2e10)
+
+_stages = contextvars.ContextVar("stages", default=None)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative += bucket
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauges:
+    """Gauges read from a callback at scrape time, e.g. cache statistics."""
+
+    def __init__(self, name: str, help: str, collect):
+        self.name, self.help, self.collect = name, help, collect
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("wsi_request_duration_seconds", "HTTP request latency", ("route", "method", "status"))
+STAGE_SECONDS = Histogram("wsi_stage_duration_seconds", "Time spent per request stage", ("route", "stage"))
+INGEST_SECONDS = Histogram(
+    "wsi_ingest_stage_duration_seconds", "Upload and extraction stage time", ("stage",),
+    buckets=LATENCY_BUCKETS + (60, 300, 900, 1800),
+)
+INGEST_BYTES = Histogram("wsi_ingest_bytes", "Size of ingested archives", (), buckets=SIZE_BUCKETS)
+RESPONSE_BYTES = Counter("wsi_response_bytes_total", "Response body bytes served", ("route",))
+ERRORS = Counter("wsi_errors_total", "Failed requests by type", ("route", "type"))
+LOOP_LAG_SECONDS = Histogram("wsi_event_loop_lag_seconds", "Event loop scheduling delay")
+
+_collectors = [REQUEST_SECONDS, STAGE_SECONDS, INGEST_SECONDS, INGEST_BYTES, RESPONSE_BYTES, ERRORS, LOOP_LAG_SECONDS]
+
+
+def register(collector):
+    _collectors.append(collector)
+    return collector
+
+
+def render() -> str:
+    lines = []
+    for collector in _collectors:
+        lines.extend(collector.render())
+    return "\n".join(lines) + "\n"
+
+
+def add_stage(name: str, seconds: float):
+    stages = _stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def ingest_stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        INGEST_SECONDS.observe(time.perf_counter() - start, name)
+
+
+def server_timing(stages: list, total: float) -> str:
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+async def sample_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+class StackSampler(threading.Thread):
+    """Samples every thread's stack into a ring buffer while slow-request profiling is on."""
+
+    def __init__(self, interval=PROFILE_INTERVAL, keep_seconds=60):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.samples = deque(maxlen=int(keep_seconds / interval))
+        self._halt = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._halt.wait(self.interval):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(ident, str(ident)))
+                self.samples.append((now, ";".join(reversed(stack))))
+
+    def stop(self):
+        self._halt.set()
+
+    def dump(self, start: float, end: float, path: Path):
+        # Collapsed-stack format, readable by flamegraph.pl and speedscope
+        folded = {}
+        for stamp, stack in list(self.samples):
+            if start <= stamp <= end:
+                folded[stack] = folded.get(stack, 0) + 1
+        if not folded:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in sorted(folded.items())))
+
+
+_sampler = None
+
+
+def start_profiler():
+    global _sampler
+    if PROFILE_SLOW_MS > 0 and _sampler is None:
+        _sampler = StackSampler()
+        _sampler.start()
+
+
+def stop_profiler():
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler.join()
+        _sampler = None
+
+
+class MetricsMiddleware:
+    """Times every request, records its stages and optionally emits Server-Timing."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stages = []
+        token = _stages.set(stages)
+        start = time.perf_counter()
+        status = {"code": 500, "bytes": 0}
+        want_timing = SERVER_TIMING or any(
+            k == SERVER_TIMING_HEADER.encode() and v not in (b"", b"0") for k, v in scope.get("headers", [])
+        )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if want_timing:
+                    timing = server_timing(stages, time.perf_counter() - start)
+                    message = dict(message, headers=list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode())
+                    ])
+            elif message["type"] == "http.response.body":
+                status["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            error = type(exc).__name__
+            raise
+        finally:
+            _stages.reset(token)
+            elapsed = time.perf_counter() - start
+            route = self.route(scope)
+            REQUEST_SECONDS.observe(elapsed, route, scope["method"], status["code"])
+            RESPONSE_BYTES.inc(route, amount=status["bytes"])
+            for name, seconds in stages:
+                STAGE_SECONDS.observe(seconds, route, name)
+            if error is None and status["code"] >= 400:
+                error = str(status["code"])
+            if error is not None:
+                ERRORS.inc(route, error)
+            sampler = _sampler
+            if sampler is not None and elapsed * 1000 >= PROFILE_SLOW_MS:
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{route.strip('/').replace('/', '_')}"
+                end = time.perf_counter()
+                asyncio.get_running_loop().run_in_executor(
+                    None, sampler.dump, start, end, PROFILE_DIR / f"{name}.folded"
+                )
+
+    @staticmethod
+    def route(scope) -> str:
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        if scope["path"].startswith("/static/"):
+            return "/static"
+        return "unmatched"
@@ -0,0 +1,42 @@
+import base64
+import json
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def page_size(limit: int) -> int:
+    return max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+def encode_cursor(*values) -> str:
+    # Opaque to clients: the sort key of the last row on the page
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    # Cursors come back from clients, so every value is checked against the expected sort key types
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if (
+        not isinstance(values, list)
+        or len(values) != len(types)
+        or any(type(value) is not kind for value, kind in zip(values, types))
+        # Integer keys are bound to SQLite's signed 64-bit range
+        or any(kind is int and not -2**63 <= value < 2**63 for value, kind in zip(values, types))
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def page(items: list, limit: int, cursor_for) -> dict:
+    # Callers fetch limit + 1 rows so the presence of a next page costs no extra query
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = cursor_for(items[-1])
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,201 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import update
+from sqlalchemy.future import select
+
+from db import Slide, AsyncSessionLocal
+from backend.slide_cache import registry
+from backend import leases
+from backend.tile_encoding import DEFAULT_SETTINGS, encode
+from backend.utils import atomic_write
+
+PYRAMID_WORKERS = int(os.environ.get("WSI_PYRAMID_WORKERS", os.cpu_count() or 4))
+PYRAMID_ON_UPLOAD = os.environ.get("WSI_PYRAMID_ON_UPLOAD", "0") == "1"
+LOWRES_MAX_DIM = int(os.environ.get("WSI_PYRAMID_LOWRES_MAX_DIM", 8192))
+CHUNK_TILES = 64
+PROGRESS_INTERVAL = 1.0
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_executor = None
+_jobs = {}
+
+
+def tile_path(slide_path: Path, level: int, col: int, row: int, fmt: str = DEFAULT_SETTINGS.format) -> Path:
+    # Same layout as the DZI URL: <slide>_files/<level>/<col>_<row>.<fmt>
+    return slide_path.parent / f"{slide_path.name}_files" / str(level) / f"{col}_{row}.{fmt}"
+
+
+def handle_key(slide_path: Path) -> tuple:
+    # Worker processes never see invalidate_dir, so a re-uploaded slide at the same path must get a new key
+    stat = slide_path.stat()
+    return ("pyramid", str(slide_path), stat.st_ino, stat.st_mtime_ns)
+
+
+def plan_levels(slide_path: Path, all_levels: bool) -> list:
+    with registry.open(handle_key(slide_path), slide_path) as handle:
+        dz = handle.dz
+        levels = []
+        for level in range(dz.level_count):
+            if not all_levels and max(dz.level_dimensions[level]) > LOWRES_MAX_DIM:
+                continue
+            cols, rows = dz.level_tiles[level]
+            levels.append((level, cols, rows))
+        return levels
+
+
+def plan_chunks(levels: list) -> list:
+    chunks = []
+    for level, cols, rows in levels:
+        rows_per_chunk = max(1, CHUNK_TILES // cols)
+        for start in range(0, rows, rows_per_chunk):
+            chunks.append((level, cols, start, min(rows, start + rows_per_chunk)))
+    return chunks
+
+
+def render_chunk(slide_path: Path, level: int, cols: int, row_start: int, row_end: int) -> int:
+    # Runs in a worker process; tiles that already exist are skipped so jobs can resume
+    with registry.open(handle_key(slide_path), slide_path) as handle:
+        for row in range(row_start, row_end):
+            for col in range(cols):
+                target = tile_path(slide_path, level, col, row)
+                if target.exists():
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tile = handle.dz.get_tile(level, (col, row))
+                atomic_write(target, encode(tile, DEFAULT_SETTINGS))
+    return cols * (row_end - row_start)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(PYRAMID_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def update_slide(slide_id: int, **values):
+    async with AsyncSessionLocal() as db:
+        slide = await db.get(Slide, slide_id)
+        if slide is None:
+            return
+        for name, value in values.items():
+            setattr(slide, name, value)
+        await db.commit()
+
+
+async def build_pyramid(slide_id: int):
+    async with AsyncSessionLocal() as db:
+        slide = await db.get(Slide, slide_id)
+        if slide is None:
+            return
+        slide_path = Path(slide.path) / slide.filename
+        all_levels = bool(slide.pyramid_all_levels)
+
+    loop = asyncio.get_running_loop()
+    futures = []
+    try:
+        levels = await loop.run_in_executor(None, plan_levels, slide_path, all_levels)
+        chunks = plan_chunks(levels)
+        total = sum(cols * rows for _, cols, rows in levels)
+        await update_slide(slide_id, pyramid_status="running", pyramid_done=0, pyramid_total=total, pyramid_error=None)
+
+        executor = get_executor()
+        futures = [loop.run_in_executor(executor, render_chunk, slide_path, *chunk) for chunk in chunks]
+        done = 0
+        last_report = time.monotonic()
+        for future in asyncio.as_completed(futures):
+            done += await future
+            if time.monotonic() - last_report > PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await update_slide(slide_id, pyramid_done=done)
+        await update_slide(slide_id, pyramid_status="done", pyramid_done=done)
+    except asyncio.CancelledError:
+        # Leave the status as running so the job resumes on the next startup
+        raise
+    except Exception as exc:
+        await update_slide(slide_id, pyramid_status="failed", pyramid_error=str(exc))
+    finally:
+        # Queued chunks are dropped; a chunk already running finishes but its result is ignored
+        for future in futures:
+            if not future.cancel() and not future.cancelled():
+                future.exception()
+
+
+async def run_job(slide_id: int):
+    # Every worker process resumes jobs, so the lease decides which one renders
+    try:
+        async with leases.hold(
+            Slide.pyramid_owner, Slide.pyramid_lease_expires,
+            Slide.id == slide_id, Slide.pyramid_status.in_(ACTIVE_STATUSES),
+        ) as claimed:
+            if claimed:
+                await build_pyramid(slide_id)
+    finally:
+        _jobs.pop(slide_id, None)
+
+
+def launch(slide_id: int):
+    if slide_id not in _jobs:
+        _jobs[slide_id] = asyncio.create_task(run_job(slide_id))
+    return _jobs[slide_id]
+
+
+async def start_job(slide_id: int, all_levels: bool = None):
+    if slide_id in _jobs:
+        return _jobs[slide_id]
+    values = {"pyramid_status": "queued", "pyramid_error": None}
+    if all_levels is not None:
+        values["pyramid_all_levels"] = all_levels
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Slide)
+            .where(Slide.id == slide_id, leases.available(Slide.pyramid_owner, Slide.pyramid_lease_expires))
+            .values(values)
+        )
+        await db.commit()
+    if result.rowcount == 0:
+        # Missing, or already being rendered by another worker
+        return None
+    return launch(slide_id)
+
+
+async def resume_jobs():
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Slide.id).where(
+                Slide.pyramid_status.in_(ACTIVE_STATUSES),
+                leases.available(Slide.pyramid_owner, Slide.pyramid_lease_expires),
+            )
+        )
+        slide_ids = result.scalars().all()
+    for slide_id in slide_ids:
+        launch(slide_id)
+
+
+def shutdown():
+    global _executor
+    for task in _jobs.values():
+        task.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def job_status(slide: Slide) -> dict:
+    total = slide.pyramid_total or 0
+    done = slide.pyramid_done or 0
+    return {
+        "uuid": slide.uuid,
+        "status": slide.pyramid_status or "none",
+        "all_levels": bool(slide.pyramid_all_levels),
+        "done": done,
+        "total": total,
+        "progress": done / total if total else 0.0,
+        "error": slide.pyramid_error,
+    }
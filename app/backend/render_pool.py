@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from backend.slide_cache import registry
+from backend.tile_encoding import encode
+
+RENDER_EXECUTOR = os.environ.get("WSI_RENDER_EXECUTOR", "thread")
+RENDER_WORKERS = int(os.environ.get("WSI_RENDER_WORKERS", os.cpu_count() or 4))
+RENDER_QUEUE_SIZE = int(os.environ.get("WSI_RENDER_QUEUE_SIZE", max(64, RENDER_WORKERS * 16)))
+RETRY_AFTER = 1
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def render_tile(key, path, level, col, row, settings) -> tuple:
+    # Runs inside a worker; process workers keep their own registry of open slides.
+    # Stage timings travel back with the tile since contextvars do not cross processes.
+    start = time.perf_counter()
+    with registry.open(key, path) as handle:
+        stages = [("open", time.perf_counter() - start)]
+        start = time.perf_counter()
+        if handle.is_background(level, col, row):
+            stages.append(("mask", time.perf_counter() - start))
+            return handle.blank_tile(level, col, row, settings), stages
+        start = time.perf_counter()
+        tile = handle.dz.get_tile(level, (col, row))
+        stages.append(("read", time.perf_counter() - start))
+        if handle.is_blank(tile):
+            return handle.blank_tile(level, col, row, settings), stages
+    start = time.perf_counter()
+    data = encode(tile, settings)
+    stages.append(("encode", time.perf_counter() - start))
+    return data, stages
+
+
+async def wait_disconnect(request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+class _Job:
+    def __init__(self, future):
+        self.future = future
+        self.waiters = 0
+
+
+class RenderPool:
+    """Bounded executor that coalesces identical in-flight jobs."""
+
+    def __init__(self, kind=RENDER_EXECUTOR, workers=RENDER_WORKERS, max_pending=RENDER_QUEUE_SIZE):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._inflight = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="render")
+        return self._executor
+
+    def _finished(self, _):
+        with self._lock:
+            self._pending -= 1
+
+    def _start(self, job_key, fn, args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PoolSaturated()
+            self._pending += 1
+        cf = self.executor.submit(fn, *args)
+        cf.add_done_callback(self._finished)
+        job = _Job(asyncio.wrap_future(cf))
+        self._inflight[job_key] = job
+        job.future.add_done_callback(lambda _: self._forget(job_key, job))
+        return job
+
+    def _forget(self, job_key, job):
+        if self._inflight.get(job_key) is job:
+            del self._inflight[job_key]
+
+    async def run(self, job_key, fn, *args, request=None):
+        job = self._inflight.get(job_key)
+        if job is None:
+            job = self._start(job_key, fn, args)
+        job.waiters += 1
+        try:
+            if request is None:
+                return await asyncio.shield(job.future)
+            watcher = asyncio.ensure_future(wait_disconnect(request))
+            try:
+                done, _ = await asyncio.wait({job.future, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                watcher.cancel()
+            if job.future in done:
+                return job.future.result()
+            raise ClientDisconnected()
+        finally:
+            job.waiters -= 1
+            if job.waiters == 0 and not job.future.done():
+                # Nobody wants this tile any more; drops it if still queued
+                self._forget(job_key, job)
+                job.future.cancel()
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": pending,
+            "max_pending": self.max_pending,
+            "inflight": len(self._inflight),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+render_pool = RenderPool()
@@ -1,24 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import Response, StreamingResponse
-from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import time
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response, FileResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.future import select
 from pathlib import Path
-from openslide import OpenSlide, deepzoom
-from io import BytesIO
 
-from db import Slide
-from backend.dependencies import get_db
+from db import Slide, AsyncSessionLocal
+from backend.slide_cache import registry
+from backend.tile_cache import tile_cache, make_etag, etag_matches, CACHE_CONTROL
+from backend.pyramid import tile_path
+from backend.tile_encoding import make_settings, negotiate, encode_report, DEFAULT_SETTINGS
+from backend.render_pool import render_pool, render_tile, PoolSaturated, ClientDisconnected, RETRY_AFTER
+from backend.tissue import is_blank
+from backend.tile_store import tile_store
+from backend import metrics
 
 router = APIRouter()
 
-TILE_SIZE = 256
-OVERLAP = 0
-LIMIT_BOUNDS = True
 
-@router.get("/dzi/{slide_uuid}/{filename}")
-async def dzi_descriptor(slide_uuid: str, filename: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
-    slide = result.scalar_one_or_none()
+async def resolve_slide(slide_uuid: str, filename: str) -> tuple:
+    key = (slide_uuid, filename)
+    slide_path = registry.path_for(key)
+    if slide_path is not None:
+        return key, slide_path
+
+    with metrics.stage("db"):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
+            slide = result.scalar_one_or_none()
     if not slide:
         raise HTTPException(status_code=404, detail="Slide not found")
 
@@ -26,26 +37,155 @@ async def dzi_descriptor(slide_uuid: str, filename: str, db: AsyncSession = Depe
     if not slide_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
 
-    dz = deepzoom.DeepZoomGenerator(OpenSlide(str(slide_path)), TILE_SIZE, OVERLAP, LIMIT_BOUNDS)
-    return Response(dz.get_dzi("jpeg"), media_type="application/xml")
+    registry.register(key, slide_path)
+    return key, slide_path
 
-@router.get("/dzi/{slide_uuid}/{filename}_files/{level}/{col}_{row}.jpeg")
-async def dzi_tile(slide_uuid: str, filename: str, level: int, col: int, row: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
-    slide = result.scalar_one_or_none()
-    if not slide:
-        raise HTTPException(status_code=404, detail="Slide not found")
 
-    slide_path = Path(slide.path) / filename
-    if not slide_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
+def read_descriptor(key, fmt: str) -> bytes:
+    with registry.open(key) as handle:
+        return handle.dz.get_dzi(fmt).encode()
+
 
-    dz = deepzoom.DeepZoomGenerator(OpenSlide(str(slide_path)), TILE_SIZE, OVERLAP, LIMIT_BOUNDS)
+def encoder_settings(fmt: str, quality: int = None, subsampling: str = None):
     try:
-        tile = dz.get_tile(level, (col, row))
-    except Exception:
+        return make_settings(fmt, quality, subsampling)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def sample_tiles(key, level: int, samples: int) -> tuple:
+    # Evenly spaced tiles from one level, skipping glass so the report reflects tissue
+    with registry.open(key) as handle:
+        dz = handle.dz
+        level = dz.level_count - 1 if level is None else level
+        if not 0 <= level < dz.level_count:
+            raise HTTPException(status_code=400, detail="Invalid level")
+        cols, rows = dz.level_tiles[level]
+        step = max(1, (cols * rows) // (samples * 4))
+        tiles = []
+        for index in range(0, cols * rows, step):
+            address = (index % cols, index // cols)
+            if handle.is_background(level, *address):
+                continue
+            tile = dz.get_tile(level, address)
+            if not is_blank(tile):
+                tiles.append(tile)
+            if len(tiles) >= samples:
+                break
+        return level, tiles
+
+
+def background_tile(key, level: int, col: int, row: int, settings):
+    # Tiles outside the tissue mask of an already-open slide skip the render pool entirely
+    handle = registry.peek(key)
+    try:
+        if handle is not None and handle.is_background(level, col, row):
+            return handle.blank_tile(level, col, row, settings)
+    except ValueError:
         raise HTTPException(status_code=404, detail="Tile not found")
+    return None
+
+
+def cache_headers(etag: str, settings=None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if settings is not None:
+        headers["X-Tile-Encoder"] = settings.describe()
+    return headers
+
+
+def not_modified(request: Request, etag: str, headers: dict, exists: bool = False):
+    if etag_matches(request.headers.get("if-none-match"), etag, exists):
+        return Response(status_code=304, headers=headers)
+    return None
+
+@router.get("/dzi/{slide_uuid}/{filename}")
+async def dzi_descriptor(request: Request, slide_uuid: str, filename: str, format: str = None):
+    # OpenSeadragon only forwards query parameters to tile URLs when the descriptor ends in .dzi
+    filename = filename.removesuffix(".dzi")
+    fmt, negotiated = negotiate(format, request.headers.get("accept"))
+    encoder_settings(fmt)
+
+    cache_key = (slide_uuid, filename, "dzi", fmt)
+    etag = make_etag(*cache_key)
+    headers = cache_headers(etag)
+    if negotiated:
+        headers["Vary"] = "Accept"
+    if (response := not_modified(request, etag, headers)) is not None:
+        return response
+
+    data = tile_cache.get(cache_key)
+    if data is None:
+        key, _ = await resolve_slide(slide_uuid, filename)
+        with metrics.stage("open"):
+            data = await run_in_threadpool(read_descriptor, key, fmt)
+        tile_cache.put(cache_key, data)
+    if (response := not_modified(request, etag, headers, exists=True)) is not None:
+        return response
+    return Response(data, media_type="application/xml", headers=headers)
+
+@router.get("/dzi/{slide_uuid}/{filename}/encode_report")
+async def dzi_encode_report(slide_uuid: str, filename: str, level: int = None, samples: int = 16):
+    key, _ = await resolve_slide(slide_uuid, filename)
+    samples = max(1, min(samples, 256))
+    level, tiles = await run_in_threadpool(sample_tiles, key, level, samples)
+    report = await run_in_threadpool(encode_report, tiles)
+    return {"slide_uuid": slide_uuid, "level": level, "samples": len(tiles), "report": report}
+
+@router.get("/dzi/{slide_uuid}/{filename}_files/{level}/{col}_{row}.{fmt}")
+async def dzi_tile(request: Request, slide_uuid: str, filename: str, level: int, col: int, row: int, fmt: str,
+                   quality: int = None, subsampling: str = None):
+    settings = encoder_settings(fmt, quality, subsampling)
+    cache_key = (slide_uuid, filename, level, col, row, settings)
+    etag = make_etag(slide_uuid, filename, level, col, row, settings.describe())
+    headers = cache_headers(etag, settings)
+    if (response := not_modified(request, etag, headers)) is not None:
+        return response
+
+    data = tile_cache.get(cache_key)
+    if data is None:
+        key, slide_path = await resolve_slide(slide_uuid, filename)
+        prerendered = tile_path(slide_path, level, col, row)
+        if settings == DEFAULT_SETTINGS and prerendered.exists():
+            if (response := not_modified(request, etag, headers, exists=True)) is not None:
+                return response
+            return FileResponse(prerendered, media_type=settings.media_type, headers=headers)
+        data = background_tile(key, level, col, row, settings)
+    if data is None and tile_store is not None:
+        digest = tile_store.digest(slide_uuid, filename, level, col, row, settings.describe())
+        # Off the event loop: the first call per thread opens SQLite and every batch of hits writes to it
+        data = await run_in_threadpool(tile_store.get, digest, settings.format)
+        if data is not None:
+            tile_cache.put(cache_key, data)
+    if data is None:
+        start = time.perf_counter()
+        try:
+            data, stages = await render_pool.run(
+                cache_key, render_tile, key, slide_path, level, col, row, settings, request=request
+            )
+        except PoolSaturated:
+            raise HTTPException(
+                status_code=503, detail="Tile renderer busy", headers={"Retry-After": str(RETRY_AFTER)}
+            )
+        except ClientDisconnected:
+            return Response(status_code=499)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Tile not found")
+        # Whatever the worker did not spend rendering was spent waiting for a free worker
+        elapsed = time.perf_counter() - start
+        metrics.add_stage("queue", max(0.0, elapsed - sum(seconds for _, seconds in stages)))
+        for name, seconds in stages:
+            metrics.add_stage(name, seconds)
+        tile_cache.put(cache_key, data)
+        if tile_store is not None:
+            # Publishing to the shared store happens off the request path
+            asyncio.get_running_loop().run_in_executor(None, tile_store.put, digest, settings.format, data)
+    if (response := not_modified(request, etag, headers, exists=True)) is not None:
+        return response
+    return Response(data, media_type=settings.media_type, headers=headers)
 
-    buf = BytesIO()
-    tile.save(buf, format="JPEG"); buf.seek(0)
-    return StreamingResponse(buf, media_type="image/jpeg")
+@router.get("/cache/stats")
+async def cache_stats():
+    stats = {"tiles": tile_cache.stats(), "slides": registry.stats(), "render_pool": render_pool.stats()}
+    if tile_store is not None:
+        stats["tile_store"] = await run_in_threadpool(tile_store.stats)
+    return stats
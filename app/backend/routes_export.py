@@ -0,0 +1,126 @@
+import asyncio
+from collections import deque
+from itertools import islice
+from pathlib import Path
+
+from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db import Slide, ViewState
+from backend.dependencies import get_db
+from backend.slide_cache import registry
+from backend import export
+
+router = APIRouter()
+
+
+def read_bounds(key) -> tuple:
+    with registry.open(key) as handle:
+        return export.image_bounds(handle)
+
+@router.post("/export/{slide_uuid}")
+async def export_regions(slide_uuid: str, data: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
+    slide = result.scalar_one_or_none()
+    if not slide:
+        raise HTTPException(status_code=404, detail="Slide not found")
+
+    slide_path = Path(slide.path) / slide.filename
+    if not slide_path.exists():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    regions = data.get("regions") or []
+    if not regions:
+        raise HTTPException(status_code=400, detail="Missing regions")
+    if not isinstance(regions, list) or not all(isinstance(spec, dict) for spec in regions):
+        raise HTTPException(status_code=400, detail="regions must be a list of objects")
+    if len(regions) > export.MAX_EXPORT_REGIONS:
+        raise HTTPException(status_code=400, detail=f"At most {export.MAX_EXPORT_REGIONS} regions per export")
+    fmt = data.get("format", "jpeg")
+    if fmt not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {fmt}")
+    quality = data.get("quality", 90)
+    if not isinstance(quality, int) or isinstance(quality, bool) or not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be an integer from 1 to 100")
+
+    view_ids = [r["view_id"] for r in regions if "view_id" in r]
+    if any(type(view_id) is not int or not -2**63 <= view_id < 2**63 for view_id in view_ids):
+        raise HTTPException(status_code=400, detail="view_id must be an integer")
+    views = {}
+    if view_ids:
+        result = await db.execute(
+            select(ViewState).where(ViewState.slide_id == slide.id, ViewState.id.in_(view_ids))
+        )
+        views = {v.id: v for v in result.scalars()}
+
+    key = (slide_uuid, slide.filename)
+    registry.register(key, slide_path)
+    bounds = await run_in_threadpool(read_bounds, key)
+
+    jobs = []
+    for index, spec in enumerate(regions):
+        name = f"region_{index + 1}"
+        if "view_id" in spec:
+            view = views.get(spec["view_id"])
+            if view is None:
+                raise HTTPException(status_code=404, detail=f"View {spec['view_id']} not found")
+            name = f"view_{view.id}"
+            spec = {
+                "zoom": view.zoom_level, "center_x": view.center_x, "center_y": view.center_y,
+                "rotation": view.rotation, "aspect": spec.get("aspect"),
+            }
+        try:
+            if "zoom" in spec:
+                region = export.view_to_region({k: v for k, v in spec.items() if v is not None}, bounds)
+            else:
+                region = {k: float(spec[k]) for k in ("x", "y", "width", "height")}
+            size, downsample = export.output_size(
+                region, spec.get("max_size", data.get("max_size")), spec.get("downsample", data.get("downsample"))
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid region {index + 1}: {exc}")
+        # Scaled entries say so in their name, so a fitted export is never mistaken for full resolution
+        if downsample != 1.0:
+            name = f"{name}_ds{round(downsample, 2):g}"
+        jobs.append((name, region, size))
+
+    loop = asyncio.get_running_loop()
+    _, extension = export.EXPORT_FORMATS[fmt]
+
+    async def render(name, region, size):
+        image = await loop.run_in_executor(
+            export.get_executor(), export.render_region, key, slide_path, region, size, fmt, quality
+        )
+        return name, image
+
+    async def stream():
+        # Only a small window of renders runs ahead of the client. The next region starts
+        # once one has been written out, so a slow reader holds back rendering
+        queued = iter(jobs)
+        window = deque(asyncio.ensure_future(render(*job)) for job in islice(queued, export.EXPORT_INFLIGHT))
+        sink = export.ZipStream()
+        archive = export.open_zip(sink)
+        try:
+            while window:
+                name, image = await window.popleft()
+                archive.writestr(f"{name}.{extension}", image)
+                del image
+                yield sink.drain()
+                job = next(queued, None)
+                if job is not None:
+                    window.append(asyncio.ensure_future(render(*job)))
+            archive.close()
+            yield sink.drain()
+        finally:
+            for task in window:
+                task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{slide.name}_regions.zip"'},
+    )
+
@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+
+from backend import metrics
+from backend.slide_cache import registry
+from backend.tile_cache import tile_cache
+from backend.render_pool import render_pool
+from backend.tile_store import tile_store
+
+router = APIRouter()
+
+
+def cache_stats():
+    # Numeric cache statistics as (labels, value) pairs, one series per cache and field
+    sources = {"tiles": tile_cache.stats, "slides": registry.stats, "render_pool": render_pool.stats}
+    if tile_store is not None:
+        sources["tile_store"] = tile_store.stats
+    for cache, stats in sources.items():
+        for field, value in stats().items():
+            if isinstance(value, (int, float)):
+                yield {"cache": cache, "field": field}, value
+
+
+metrics.register(metrics.Gauges("wsi_cache", "Tile, slide and render pool cache statistics", cache_stats))
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    text = await run_in_threadpool(metrics.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db import Slide
+from backend.dependencies import get_db
+from backend import pyramid
+
+router = APIRouter()
+
+@router.post("/pyramid/{slide_uuid}")
+async def start_pyramid(slide_uuid: str, all_levels: bool = False, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
+    slide = result.scalar_one_or_none()
+    if not slide:
+        raise HTTPException(status_code=404, detail="Slide not found")
+
+    await pyramid.start_job(slide.id, all_levels)
+    await db.refresh(slide)
+    return JSONResponse(pyramid.job_status(slide), status_code=202)
+
+@router.get("/pyramid/{slide_uuid}")
+async def pyramid_status(slide_uuid: str, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
+    slide = result.scalar_one_or_none()
+    if not slide:
+        raise HTTPException(status_code=404, detail="Slide not found")
+
+    return pyramid.job_status(slide)
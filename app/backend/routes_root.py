@@ -1,19 +1,80 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from pathlib import Path
 
 from db import Slide
 from backend.dependencies import get_db
+from backend.pagination import DEFAULT_PAGE_SIZE, page_size, encode_cursor, decode_cursor, page
+from backend.slide_cache import registry
+from backend.thumbnails import build_thumbnail, THUMBNAIL_MEDIA_TYPE
+from backend.tile_cache import make_etag, CACHE_CONTROL
 from fastapi import Request
 
 router = APIRouter()
 
 templates = Jinja2Templates(directory="frontend/templates")
 
+
+async def slides_page(db: AsyncSession, limit: int, cursor: str = None) -> dict:
+    # Newest first, keyed on the primary key so every page is an index range scan
+    limit = page_size(limit)
+    query = select(Slide).order_by(Slide.id.desc()).limit(limit + 1)
+    if cursor is not None:
+        (slide_id,) = decode_cursor(cursor, int)
+        query = query.where(Slide.id < slide_id)
+    result = await db.execute(query)
+    return page(result.scalars().all(), limit, lambda s: encode_cursor(s.id))
+
+
+def slide_summary(slide: Slide) -> dict:
+    return {
+        "uuid": slide.uuid,
+        "name": slide.name,
+        "filename": slide.filename,
+        "uploaded_at": slide.uploaded_at.isoformat() if slide.uploaded_at else None,
+        "viewer_url": f"/viewer/{slide.uuid}/{slide.filename}",
+        "thumbnail_url": f"/thumbnail/{slide.uuid}",
+    }
+
+
+def backfill_thumbnail(slide: Slide) -> Path:
+    # Slides ingested before thumbnails existed get theirs on first request, then keep it
+    slide_path = Path(slide.path) / slide.filename
+    with registry.open((slide.uuid, slide.filename), slide_path) as handle:
+        return build_thumbnail(handle.slide, slide_path)
+
 @router.get("/", response_class=HTMLResponse)
-async def root(request: Request, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Slide))
-    slides = result.scalars().all()
-    return templates.TemplateResponse("index.html", {"request": request, "slides": slides})
+async def root(request: Request, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+               db: AsyncSession = Depends(get_db)):
+    slides = await slides_page(db, limit, cursor)
+    return templates.TemplateResponse("index.html", {
+        "request": request, "slides": slides["items"], "next_cursor": slides["next_cursor"],
+    })
+
+@router.get("/slides")
+async def list_slides(cursor: str = None, limit: int = DEFAULT_PAGE_SIZE, db: AsyncSession = Depends(get_db)):
+    slides = await slides_page(db, limit, cursor)
+    slides["items"] = [slide_summary(s) for s in slides["items"]]
+    return slides
+
+@router.get("/thumbnail/{slide_uuid}")
+async def slide_thumbnail(slide_uuid: str, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
+    slide = result.scalar_one_or_none()
+    if not slide:
+        raise HTTPException(status_code=404, detail="Slide not found")
+
+    path = Path(slide.thumbnail) if slide.thumbnail else None
+    if path is None or not path.exists():
+        try:
+            path = await run_in_threadpool(backfill_thumbnail, slide)
+        except Exception:
+            raise HTTPException(status_code=404, detail="Thumbnail not available")
+        slide.thumbnail = str(path)
+        await db.commit()
+    headers = {"ETag": make_etag(slide_uuid, "thumbnail", path.stat().st_mtime_ns), "Cache-Control": CACHE_CONTROL}
+    return FileResponse(path, media_type=THUMBNAIL_MEDIA_TYPE, headers=headers)
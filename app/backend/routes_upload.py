@@ -1,44 +1,140 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request, Header, Body
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+from starlette.requests import ClientDisconnect
 from pathlib import Path
-import shutil
 
-from db import Slide
+from db import IngestJob
 from backend.dependencies import get_db
-from backend.utils import extract_zip
+from backend import ingest, pyramid, leases
 
 router = APIRouter()
 
-BASE_DIR = Path(__file__).resolve().parent.parent
-SLIDES_DIR = BASE_DIR / "slides"
-SLIDES_DIR.mkdir(exist_ok=True)
 
-@router.post("/upload")
-async def upload_slide(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
-    if not file.filename.lower().endswith(".zip"):
+async def get_job(job_id: str, db: AsyncSession) -> IngestJob:
+    result = await db.execute(
+        select(IngestJob)
+        .options(selectinload(IngestJob.slide))
+        .where(IngestJob.id == job_id)
+        .execution_options(populate_existing=True)
+    )
+    job = result.scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return job
+
+
+def check_filename(filename: str) -> str:
+    # Only the base name is kept; it becomes the slide directory under SLIDES_DIR
+    if not isinstance(filename, str) or not filename.lower().endswith(".zip"):
         raise HTTPException(status_code=400, detail="Upload must be a .zip containing .mrxs")
+    filename = Path(filename.replace("\\", "/")).name
+    try:
+        ingest.slide_dir_for(ingest.slide_name_for(filename))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return filename
 
-    slide_name = file.filename.rsplit(".", 1)[0]
-    slide_dir = SLIDES_DIR / slide_name
-    if slide_dir.exists():
-        shutil.rmtree(slide_dir)
-    slide_dir.mkdir(parents=True)
+@router.post("/upload", status_code=202)
+async def upload_slide(file: UploadFile = File(...), pregenerate: bool = pyramid.PYRAMID_ON_UPLOAD,
+                       all_levels: bool = False, db: AsyncSession = Depends(get_db)):
+    filename = check_filename(file.filename)
 
-    zip_path = SLIDES_DIR / file.filename
-    with open(zip_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    job = IngestJob(filename=filename, pregenerate=pregenerate, all_levels=all_levels)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
 
-    extract_zip(zip_path, slide_dir)
-    zip_path.unlink()
+    received = await ingest.write_stream(job.id, ingest.upload_file_chunks(file), 0)
+    job.size = received
+    job.received = received
+    await db.commit()
 
-    mrxs_files = list(slide_dir.glob("*.mrxs"))
-    if not mrxs_files:
-        raise HTTPException(status_code=400, detail="No .mrxs file found in archive")
+    if not await ingest.start_ingest(job.id):
+        raise HTTPException(status_code=409, detail="Upload is already being ingested")
+    return ingest.job_status(await get_job(job.id, db))
 
-    slide = Slide(name=slide_name, path=str(slide_dir), filename=mrxs_files[0].name)
-    db.add(slide)
+@router.post("/uploads", status_code=201)
+async def create_upload(data: dict = Body(...), db: AsyncSession = Depends(get_db)):
+    filename = check_filename(data.get("filename"))
+    size = data.get("size")
+    if size is not None and (not isinstance(size, int) or isinstance(size, bool) or not 0 <= size < 2 ** 63):
+        raise HTTPException(status_code=400, detail="size must be a non-negative integer")
+
+    job = IngestJob(
+        filename=filename,
+        size=size,
+        pregenerate=bool(data.get("pregenerate", pyramid.PYRAMID_ON_UPLOAD)),
+        all_levels=bool(data.get("all_levels", False)),
+    )
+    db.add(job)
     await db.commit()
-    await db.refresh(slide)
+    return ingest.job_status(await get_job(job.id, db))
+
+@router.head("/uploads/{job_id}")
+async def upload_offset(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = await get_job(job_id, db)
+    headers = {"Upload-Offset": str(ingest.current_offset(job.id)), "Cache-Control": "no-store"}
+    if job.size is not None:
+        headers["Upload-Length"] = str(job.size)
+    return Response(status_code=204, headers=headers)
+
+@router.patch("/uploads/{job_id}")
+async def upload_chunk(request: Request, job_id: str, upload_offset: int = Header(...),
+                       db: AsyncSession = Depends(get_db)):
+    job = await get_job(job_id, db)
+    if job.status != "uploading":
+        raise HTTPException(status_code=409, detail=f"Upload is {job.status}")
+
+    # Release the connection while the body streams in
+    await db.commit()
+    # The lease keeps two workers from appending to the same file at once
+    async with leases.hold(
+        IngestJob.lease_owner, IngestJob.lease_expires, IngestJob.id == job_id, IngestJob.status == "uploading"
+    ) as claimed:
+        if not claimed:
+            raise HTTPException(status_code=409, detail="Upload already in progress")
+        limit = None if job.size is None else job.size - upload_offset
+        length = request.headers.get("content-length")
+        if limit is not None and length is not None and length.isdigit() and int(length) > limit:
+            return JSONResponse(
+                {"detail": "Upload exceeds declared size"},
+                status_code=413, headers={"Upload-Offset": str(ingest.current_offset(job_id))},
+            )
+        try:
+            offset = await ingest.write_stream(job_id, request.stream(), upload_offset, limit)
+        except ingest.OffsetMismatch as exc:
+            return Response(status_code=409, headers={"Upload-Offset": str(exc.offset)})
+        except ingest.UploadTooLarge as exc:
+            return JSONResponse(
+                {"detail": "Upload exceeds declared size"},
+                status_code=413, headers={"Upload-Offset": str(exc.offset)},
+            )
+        except ClientDisconnect:
+            offset = ingest.current_offset(job_id)
+
+    job.received = offset
+    await db.commit()
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+@router.post("/uploads/{job_id}/complete", status_code=202)
+async def complete_upload(job_id: str, db: AsyncSession = Depends(get_db)):
+    job = await get_job(job_id, db)
+    if job.status != "uploading":
+        raise HTTPException(status_code=409, detail=f"Upload is {job.status}")
+    offset = ingest.current_offset(job_id)
+    if job.size is not None and offset != job.size:
+        return JSONResponse(
+            {"detail": "Upload incomplete", "offset": offset},
+            status_code=409, headers={"Upload-Offset": str(offset)},
+        )
+
+    if not await ingest.start_ingest(job_id):
+        raise HTTPException(status_code=409, detail="Upload is already being ingested")
+    return ingest.job_status(await get_job(job_id, db))
 
-    return RedirectResponse(url=f"/viewer/{slide.uuid}/{mrxs_files[0].name}", status_code=303)
+@router.get("/ingest/{job_id}")
+async def ingest_status(job_id: str, db: AsyncSession = Depends(get_db)):
+    return ingest.job_status(await get_job(job_id, db))
@@ -7,6 +7,7 @@ from fastapi import Request
 
 from db import Slide
 from backend.dependencies import get_db
+from backend.export import MAX_EXPORT_REGIONS
 
 router = APIRouter()
 
@@ -21,5 +22,6 @@ async def viewer(request: Request, slide_uuid: str, filename: str, db: AsyncSess
 
     return templates.TemplateResponse(
         "viewer.html",
-        {"request": request, "slide_uuid": slide_uuid, "filename": filename}
+        {"request": request, "slide_uuid": slide_uuid, "filename": filename,
+         "max_export_regions": MAX_EXPORT_REGIONS}
     )
\ No newline at end of file
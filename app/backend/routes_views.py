@@ -1,15 +1,41 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, tuple_
 from sqlalchemy.future import select
 from base64 import b64decode
+from datetime import datetime
 from io import BytesIO
 
 from db import Slide, ViewState
 from backend.dependencies import get_db
+from backend.pagination import DEFAULT_PAGE_SIZE, page_size, encode_cursor, decode_cursor, page
 
 router = APIRouter()
 
+
+async def views_page(db: AsyncSession, slide_uuid: str, limit: int, cursor: str = None) -> list:
+    # One query: the outer join keeps the slide row when it has no views, so 404 and "no views" stay distinct
+    on = [ViewState.slide_id == Slide.id]
+    if cursor is not None:
+        saved_at, view_id = decode_cursor(cursor, str, int)
+        try:
+            saved_at = datetime.fromisoformat(saved_at)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        on.append(tuple_(ViewState.saved_at, ViewState.id) < tuple_(saved_at, view_id))
+    result = await db.execute(
+        select(Slide.id, ViewState)
+        .outerjoin(ViewState, and_(*on))
+        .where(Slide.uuid == slide_uuid)
+        .order_by(ViewState.saved_at.desc(), ViewState.id.desc())
+        .limit(limit)
+    )
+    rows = result.all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Slide not found")
+    return [row.ViewState for row in rows if row.ViewState is not None]
+
 @router.post("/save_view/{slide_uuid}")
 async def save_view(slide_uuid: str, data: dict = Body(...), db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
@@ -19,11 +45,8 @@ async def save_view(slide_uuid: str, data: dict = Body(...), db: AsyncSession =
 
     snapshot_b64 = data.get("snapshot")
     view = data.get("viewState")
-    if not snapshot_b64 or not view:
-        raise HTTPException(status_code=400, detail="Missing snapshot or viewState")
-
-    header, encoded = snapshot_b64.split(",", 1)
-    img_bytes = b64decode(encoded)
+    if not view:
+        raise HTTPException(status_code=400, detail="Missing viewState")
 
     state = ViewState(
         slide_id=slide.id,
@@ -34,6 +57,12 @@ async def save_view(slide_uuid: str, data: dict = Body(...), db: AsyncSession =
     )
     db.add(state); await db.commit(); await db.refresh(state)
 
+    # Snapshots are optional now that images are rendered server-side via /export
+    if not snapshot_b64:
+        return {"id": state.id, "saved_at": state.saved_at.isoformat()}
+
+    header, encoded = snapshot_b64.split(",", 1)
+    img_bytes = b64decode(encoded)
     return StreamingResponse(
         BytesIO(img_bytes),
         media_type="image/jpeg",
@@ -42,18 +71,11 @@ async def save_view(slide_uuid: str, data: dict = Body(...), db: AsyncSession =
 
 @router.get("/last_view/{slide_uuid}")
 async def last_view(slide_uuid: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
-    slide = result.scalar_one_or_none()
-    if not slide:
-        raise HTTPException(status_code=404, detail="Slide not found")
-
-    result = await db.execute(
-        select(ViewState).where(ViewState.slide_id==slide.id).order_by(ViewState.saved_at.desc())
-    )
-    state = result.scalars().first()
-    if not state:
+    states = await views_page(db, slide_uuid, 1)
+    if not states:
         return {"status":"no view saved"}
 
+    state = states[0]
     return {
         "zoom": state.zoom_level,
         "center_x": state.center_x,
@@ -63,17 +85,12 @@ async def last_view(slide_uuid: str, db: AsyncSession = Depends(get_db)):
     }
 
 @router.get("/all_views/{slide_uuid}")
-async def all_views(slide_uuid: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Slide).where(Slide.uuid == slide_uuid))
-    slide = result.scalar_one_or_none()
-    if not slide:
-        raise HTTPException(status_code=404, detail="Slide not found")
-
-    result = await db.execute(
-        select(ViewState).where(ViewState.slide_id == slide.id).order_by(ViewState.saved_at.desc())
-    )
-    states = result.scalars().all()
-    return [
+async def all_views(slide_uuid: str, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None,
+                    db: AsyncSession = Depends(get_db)):
+    limit = page_size(limit)
+    states = await views_page(db, slide_uuid, limit + 1, cursor)
+    result = page(states, limit, lambda s: encode_cursor(s.saved_at.isoformat(), s.id))
+    result["items"] = [
         {
             "id": s.id,
             "zoom": s.zoom_level,
@@ -82,5 +99,6 @@ async def all_views(slide_uuid: str, db: AsyncSession = Depends(get_db)):
             "rotation": s.rotation,
             "saved_at": s.saved_at.isoformat(),
         }
-        for s in states
+        for s in result["items"]
     ]
+    return result
@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+from openslide import OpenSlide, deepzoom
+
+from backend.tissue import TissueMask, build_mask, blank_tile, is_blank
+from backend.tile_encoding import EncoderSettings, DEFAULT_SETTINGS
+
+TILE_SIZE = 256
+OVERLAP = 0
+LIMIT_BOUNDS = True
+
+MAX_OPEN_SLIDES = int(os.environ.get("WSI_MAX_OPEN_SLIDES", 32))
+MAX_OPEN_FDS = int(os.environ.get("WSI_MAX_OPEN_FDS", 512))
+IDLE_TIMEOUT = float(os.environ.get("WSI_SLIDE_IDLE_TIMEOUT", 600))
+MAX_KNOWN_PATHS = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_fds(path: Path) -> int:
+    # .mrxs keeps its Data*.dat files in a sibling directory named after the slide
+    data_dir = path.with_suffix("")
+    if path.suffix.lower() == ".mrxs" and data_dir.is_dir():
+        return 1 + sum(1 for _ in data_dir.glob("*.dat"))
+    return 1
+
+
+class SlideHandle:
+    def __init__(self, key, path: Path):
+        self.key = key
+        self.path = path
+        self.slide = OpenSlide(str(path))
+        self.dz = deepzoom.DeepZoomGenerator(self.slide, TILE_SIZE, OVERLAP, LIMIT_BOUNDS)
+        self.mask = self.load_mask()
+        self.background = self.mask.glass if self.mask is not None else None
+        self.level_downsamples = self.slide.level_downsamples
+        self.fds = estimate_fds(path)
+        self.last_used = time.monotonic()
+        self.users = 0
+        self.evicted = False
+
+    def load_mask(self):
+        mask = TissueMask.load(self.path, self.slide.dimensions)
+        if mask is not None and mask.measured:
+            return mask
+        # Slides added outside ingest, or masked before glass sampling, get their mask built
+        # once here and stored beside the slide. A failure only disables the glass fast paths.
+        try:
+            build_mask(self.slide, self.path)
+            return TissueMask.load(self.path, self.slide.dimensions)
+        except Exception:
+            logger.exception("Could not build tissue mask for %s", self.path)
+            return mask
+
+    def is_background(self, level: int, col: int, row: int) -> bool:
+        # Answers from the stored tissue mask without reading any pixels
+        if self.mask is None or self.background is None:
+            return False
+        (x, y), slide_level, (width, height) = self.dz.get_tile_coordinates(level, (col, row))
+        downsample = self.level_downsamples[slide_level]
+        return not self.mask.has_tissue(x, y, width * downsample, height * downsample)
+
+    def is_blank(self, tile) -> bool:
+        # Without a measured glass colour a flat replacement would not match its neighbours
+        return self.background is not None and is_blank(tile, self.background)
+
+    def blank_tile(self, level: int, col: int, row: int, settings: EncoderSettings = DEFAULT_SETTINGS) -> bytes:
+        return blank_tile(self.dz.get_tile_dimensions(level, (col, row)), self.background, settings)
+
+    def close(self):
+        self.slide.close()
+
+
+class SlideRegistry:
+    """Process-wide LRU of open slides keyed by (slide_uuid, filename)."""
+
+    def __init__(self, max_handles=MAX_OPEN_SLIDES, max_fds=MAX_OPEN_FDS, idle_timeout=IDLE_TIMEOUT):
+        self.max_handles = max_handles
+        self.max_fds = max_fds
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._handles = OrderedDict()
+        self._paths = OrderedDict()
+        self._fds = 0
+
+    def path_for(self, key):
+        with self._lock:
+            path = self._paths.get(key)
+            if path is not None:
+                self._paths.move_to_end(key)
+            return path
+
+    def register(self, key, path: Path):
+        with self._lock:
+            self._paths[key] = path
+            self._paths.move_to_end(key)
+            while len(self._paths) > MAX_KNOWN_PATHS:
+                self._paths.popitem(last=False)
+
+    def peek(self, key):
+        # Only for metadata and the tissue mask; the slide may be closed at any time
+        with self._lock:
+            return self._handles.get(key)
+
+    @contextmanager
+    def open(self, key, path: Path = None):
+        handle = self._acquire(key, path)
+        try:
+            yield handle
+        finally:
+            self._release(handle)
+
+    def _acquire(self, key, path):
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                handle.users += 1
+                handle.last_used = time.monotonic()
+                return handle
+            path = path or self._paths.get(key)
+        if path is None:
+            raise KeyError(key)
+
+        # Opening an .mrxs parses its index, so do it without holding the lock
+        opened = SlideHandle(key, path)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = opened
+                self._handles[key] = handle
+                self._paths[key] = path
+                self._fds += handle.fds
+            else:
+                self._handles.move_to_end(key)
+            handle.users += 1
+            handle.last_used = time.monotonic()
+            stale = self._evict_locked(keep=key)
+        if handle is not opened:
+            opened.close()
+        for h in stale:
+            h.close()
+        return handle
+
+    def _release(self, handle):
+        with self._lock:
+            handle.users -= 1
+            handle.last_used = time.monotonic()
+            close = handle.evicted and handle.users == 0
+        if close:
+            handle.close()
+
+    def _evict_locked(self, keep=None):
+        now = time.monotonic()
+        stale = []
+        for key in list(self._handles):
+            if key == keep:
+                continue
+            handle = self._handles[key]
+            over_limit = len(self._handles) > self.max_handles or self._fds > self.max_fds
+            idle = now - handle.last_used > self.idle_timeout
+            if not over_limit and not idle:
+                break
+            stale.extend(self._drop_locked(key))
+        return stale
+
+    def _drop_locked(self, key):
+        handle = self._handles.pop(key)
+        self._fds -= handle.fds
+        handle.evicted = True
+        return [handle] if handle.users == 0 else []
+
+    def sweep(self):
+        with self._lock:
+            stale = self._evict_locked()
+        for h in stale:
+            h.close()
+
+    def invalidate_dir(self, directory: Path):
+        directory = Path(directory).resolve()
+        stale = []
+        with self._lock:
+            for key, path in list(self._paths.items()):
+                if Path(path).resolve().is_relative_to(directory):
+                    del self._paths[key]
+                    if key in self._handles:
+                        stale.extend(self._drop_locked(key))
+        for h in stale:
+            h.close()
+
+    def stats(self):
+        with self._lock:
+            return {"open_slides": len(self._handles), "open_fds": self._fds, "known_paths": len(self._paths)}
+
+
+registry = SlideRegistry()
@@ -0,0 +1,23 @@
+import io
+import os
+from pathlib import Path
+
+from backend.utils import atomic_write
+
+THUMBNAIL_SIZE = int(os.environ.get("WSI_THUMBNAIL_SIZE", 256))
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_MEDIA_TYPE = "image/jpeg"
+
+
+def thumbnail_path(slide_path: Path) -> Path:
+    return slide_path.parent / f"{slide_path.name}.thumb.jpg"
+
+
+def build_thumbnail(slide, slide_path: Path) -> Path:
+    # get_thumbnail reads from the smallest level that covers the size, so this stays cheap
+    thumbnail = slide.get_thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE)).convert("RGB")
+    target = thumbnail_path(slide_path)
+    buf = io.BytesIO()
+    thumbnail.save(buf, format="JPEG", quality=THUMBNAIL_QUALITY)
+    atomic_write(target, buf.getvalue())
+    return target
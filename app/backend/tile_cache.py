@@ -0,0 +1,73 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+TILE_CACHE_BYTES = int(os.environ.get("WSI_TILE_CACHE_BYTES", 256 * 1024 * 1024))
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1("/".join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str, exists: bool = False) -> bool:
+    # "*" matches any current representation, so it only counts once the resource is known to exist
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return (exists and "*" in candidates) or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+class TileCache:
+    """Byte-budgeted LRU of encoded tile bytes."""
+
+    def __init__(self, max_bytes=TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+tile_cache = TileCache()
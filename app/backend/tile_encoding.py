@@ -0,0 +1,112 @@
+import os
+import time
+from dataclasses import dataclass
+from io import BytesIO
+
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+SUBSAMPLING = {"4:4:4": 0, "4:2:2": 1, "4:2:0": 2}
+DEFAULT_QUALITY = {"jpeg": 75, "webp": 80, "png": None}
+
+DEFAULT_FORMAT = os.environ.get("WSI_TILE_FORMAT", "jpeg")
+JPEG_QUALITY = int(os.environ.get("WSI_JPEG_QUALITY", DEFAULT_QUALITY["jpeg"]))
+JPEG_SUBSAMPLING = os.environ.get("WSI_JPEG_SUBSAMPLING", "4:2:0")
+WEBP_QUALITY = int(os.environ.get("WSI_WEBP_QUALITY", DEFAULT_QUALITY["webp"]))
+
+
+@dataclass(frozen=True)
+class EncoderSettings:
+    format: str = "jpeg"
+    quality: int = None
+    subsampling: str = None
+
+    @property
+    def media_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def save_kwargs(self) -> dict:
+        kwargs = {"format": FORMATS[self.format][0]}
+        if self.quality is not None:
+            kwargs["quality"] = self.quality
+        if self.subsampling is not None:
+            kwargs["subsampling"] = SUBSAMPLING[self.subsampling]
+        return kwargs
+
+    def describe(self) -> str:
+        parts = [f"format={self.format}"]
+        if self.quality is not None:
+            parts.append(f"quality={self.quality}")
+        if self.subsampling is not None:
+            parts.append(f"subsampling={self.subsampling}")
+        return "; ".join(parts)
+
+
+def make_settings(fmt: str, quality: int = None, subsampling: str = None) -> EncoderSettings:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported tile format {fmt}")
+    if fmt == "png":
+        return EncoderSettings("png")
+    if quality is None:
+        quality = JPEG_QUALITY if fmt == "jpeg" else WEBP_QUALITY
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    if fmt == "jpeg":
+        subsampling = subsampling or JPEG_SUBSAMPLING
+        if subsampling not in SUBSAMPLING:
+            raise ValueError(f"subsampling must be one of {', '.join(SUBSAMPLING)}")
+        return EncoderSettings("jpeg", quality, subsampling)
+    return EncoderSettings("webp", quality)
+
+
+DEFAULT_SETTINGS = make_settings("jpeg")
+
+
+def negotiate(requested: str, accept: str) -> tuple:
+    # Returns the format and whether it depended on the Accept header
+    fmt = requested or DEFAULT_FORMAT
+    if fmt != "auto":
+        return fmt, False
+    return ("webp" if "image/webp" in (accept or "") else "jpeg"), True
+
+
+def encode(image, settings: EncoderSettings) -> bytes:
+    if settings.format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = BytesIO()
+    image.save(buf, **settings.save_kwargs())
+    return buf.getvalue()
+
+
+REPORT_SETTINGS = [
+    make_settings("jpeg", 60, "4:2:0"),
+    make_settings("jpeg", 75, "4:2:0"),
+    make_settings("jpeg", 90, "4:2:0"),
+    make_settings("jpeg", 90, "4:4:4"),
+    make_settings("webp", 60),
+    make_settings("webp", 75),
+    make_settings("webp", 90),
+    make_settings("png"),
+]
+
+
+def encode_report(tiles: list, settings_list: list = None) -> list:
+    report = []
+    for settings in settings_list or REPORT_SETTINGS:
+        sizes, timings = [], []
+        for tile in tiles:
+            start = time.perf_counter()
+            sizes.append(len(encode(tile, settings)))
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        report.append({
+            "encoder": settings.describe(),
+            "tiles": len(tiles),
+            "mean_bytes": sum(sizes) / len(sizes) if sizes else 0,
+            "total_bytes": sum(sizes),
+            "mean_encode_ms": 1000 * sum(timings) / len(timings) if timings else 0,
+            "p95_encode_ms": 1000 * timings[int(0.95 * (len(timings) - 1))] if timings else 0,
+        })
+    return report
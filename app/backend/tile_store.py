@@ -0,0 +1,155 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from backend.config import SLIDES_DIR
+from backend.utils import atomic_write
+
+TILE_STORE_ENABLED = os.environ.get("WSI_TILE_STORE", "1") == "1"
+TILE_STORE_DIR = Path(os.environ.get("WSI_TILE_STORE_DIR", SLIDES_DIR / ".tilecache"))
+TILE_STORE_INDEX = Path(os.environ.get("WSI_TILE_STORE_INDEX", "./tilecache.db"))
+TILE_STORE_BYTES = int(os.environ.get("WSI_TILE_STORE_BYTES", 10 * 1024 ** 3))
+EVICT_TARGET = 0.9
+TOUCH_BATCH = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_tiles_last_access ON tiles (last_access);
+"""
+
+
+class TileStore:
+    """Content-addressed tile files shared by every worker on the same volume.
+
+    Files are published with an atomic rename and tracked in a small SQLite
+    index that drives least-recently-used eviction once the size cap is hit.
+    """
+
+    def __init__(self, root: Path = TILE_STORE_DIR, index: Path = TILE_STORE_INDEX, max_bytes=TILE_STORE_BYTES):
+        self.root = root
+        self.index = index
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._written_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.index, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def digest(*parts) -> str:
+        return hashlib.sha256("/".join(str(p) for p in parts).encode()).hexdigest()
+
+    def path_for(self, digest: str, extension: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}.{extension}"
+
+    def get(self, digest: str, extension: str):
+        # Reads the bytes rather than returning a path: another worker may evict the file at any moment
+        try:
+            data = self.path_for(digest, extension).read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._touched[digest] = time.time()
+            flush = len(self._touched) >= TOUCH_BATCH
+        if flush:
+            self.flush()
+        return data
+
+    def put(self, digest: str, extension: str, data: bytes):
+        path = self.path_for(digest, extension)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The index row goes in first so a crash can only leave a row without a file, never an untracked file
+        self._db().execute(
+            "INSERT OR REPLACE INTO tiles (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+            (digest, str(path), len(data), time.time()),
+        )
+        atomic_write(path, data)
+        with self._lock:
+            self.writes += 1
+            self._written_since_check += len(data)
+            check = self._written_since_check >= self.max_bytes * (1 - EVICT_TARGET) / 10
+            if check:
+                self._written_since_check = 0
+        if check:
+            self.evict()
+
+    def flush(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if touched:
+            self._db().executemany(
+                "UPDATE tiles SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(stamp, digest) for digest, stamp in touched.items()],
+            )
+
+    def evict(self):
+        self.flush()
+        conn = self._db()
+        # BEGIN IMMEDIATE takes the write lock so only one worker evicts at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM tiles").fetchone()[0]
+            if total <= self.max_bytes:
+                conn.execute("COMMIT")
+                return 0
+            excess = total - int(self.max_bytes * EVICT_TARGET)
+            victims, freed = [], 0
+            for digest, path, size in conn.execute("SELECT key, path, size FROM tiles ORDER BY last_access"):
+                victims.append((digest, path))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM tiles WHERE key = ?", [(d,) for d, _ in victims])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for _, path in victims:
+            Path(path).unlink(missing_ok=True)
+        with self._lock:
+            self.evictions += len(victims)
+        return len(victims)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "max_bytes": self.max_bytes,
+            }
+        stats["bytes"], stats["entries"] = self._db().execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM tiles"
+        ).fetchone()
+        return stats
+
+
+tile_store = TileStore() if TILE_STORE_ENABLED else None
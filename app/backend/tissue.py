@@ -0,0 +1,121 @@
+import io
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFilter
+from PIL.PngImagePlugin import PngInfo
+
+from backend.tile_encoding import EncoderSettings, DEFAULT_SETTINGS, encode
+from backend.utils import atomic_write
+
+MASK_MAX_DIM = int(os.environ.get("WSI_TISSUE_MASK_DIM", 2048))
+BACKGROUND_MIN = 215
+BACKGROUND_SPREAD = 18
+# A rendered tile is replaced by the flat glass tile only when its pixels stay within
+# BLANK_TOLERANCE of the glass colour; BLANK_FRACTION is the share allowed to differ more
+BLANK_TOLERANCE = int(os.environ.get("WSI_BLANK_TOLERANCE", 6))
+BLANK_FRACTION = float(os.environ.get("WSI_BLANK_TISSUE_FRACTION", 0))
+GLASS_SAMPLE_DIM = 4096
+MASK_DILATE = 5
+
+
+def background_color(slide) -> tuple:
+    color = slide.properties.get("openslide.background-color", "ffffff")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def tissue_pixels(rgba: np.ndarray) -> np.ndarray:
+    # Glass is bright and unsaturated; transparent pixels lie outside the scanned area
+    rgb = rgba[..., :3]
+    low, high = rgb.min(axis=-1), rgb.max(axis=-1)
+    glass = (low >= BACKGROUND_MIN) & (high - low <= BACKGROUND_SPREAD)
+    if rgba.shape[-1] == 4:
+        glass |= rgba[..., 3] == 0
+    return ~glass
+
+
+def glass_color(rgba: np.ndarray):
+    # Median of the pixels classed as glass; scanned glass is rarely the white the slide properties claim
+    glass = ~tissue_pixels(rgba)
+    if rgba.shape[-1] == 4:
+        glass &= rgba[..., 3] > 0
+    if not glass.any():
+        return None
+    return tuple(int(v) for v in np.median(rgba[..., :3][glass], axis=0))
+
+
+def measure_glass(slide):
+    # The smallest level keeps its alpha channel, so unscanned areas are not mistaken for glass
+    level = slide.level_count - 1
+    width, height = slide.level_dimensions[level]
+    if max(width, height) <= GLASS_SAMPLE_DIM:
+        image = slide.read_region((0, 0), level, (width, height))
+    else:
+        image = slide.get_thumbnail((GLASS_SAMPLE_DIM, GLASS_SAMPLE_DIM)).convert("RGBA")
+    return glass_color(np.asarray(image))
+
+
+def is_blank(tile: Image.Image, color: tuple = None) -> bool:
+    # With a colour, bright areas that are not that glass (unscanned white, pale stain) stay as rendered
+    pixels = np.asarray(tile)
+    if pixels.ndim != 3:
+        return False
+    if color is None:
+        differs = tissue_pixels(pixels)
+    else:
+        distance = np.abs(pixels[..., :3].astype(np.int16) - np.array(color, dtype=np.int16)).max(axis=-1)
+        differs = distance > BLANK_TOLERANCE
+    return np.count_nonzero(differs) <= BLANK_FRACTION * pixels.shape[0] * pixels.shape[1]
+
+
+@lru_cache(maxsize=256)
+def blank_tile(size: tuple, color: tuple, settings: EncoderSettings = DEFAULT_SETTINGS) -> bytes:
+    return encode(Image.new("RGB", size, color), settings)
+
+
+def mask_path(slide_path: Path) -> Path:
+    return slide_path.parent / f"{slide_path.name}.tissue.png"
+
+
+def build_mask(slide, slide_path: Path) -> Path:
+    thumbnail = slide.get_thumbnail((MASK_MAX_DIM, MASK_MAX_DIM)).convert("RGBA")
+    tissue = tissue_pixels(np.asarray(thumbnail))
+    # Grow the mask a little so tiles at the tissue edge are never dropped
+    mask = Image.fromarray((tissue * 255).astype(np.uint8)).filter(ImageFilter.MaxFilter(MASK_DILATE))
+    info = PngInfo()
+    glass = measure_glass(slide)
+    # Written even when no glass was found, so the slide is not measured again
+    info.add_text("glass-color", "%02x%02x%02x" % glass if glass is not None else "")
+    target = mask_path(slide_path)
+    buf = io.BytesIO()
+    mask.save(buf, format="PNG", pnginfo=info)
+    atomic_write(target, buf.getvalue())
+    return target
+
+
+class TissueMask:
+    def __init__(self, mask: np.ndarray, slide_dimensions: tuple, glass: tuple = None, measured: bool = True):
+        self.mask = mask
+        self.glass = glass
+        self.measured = measured
+        self.scale_x = mask.shape[1] / slide_dimensions[0]
+        self.scale_y = mask.shape[0] / slide_dimensions[1]
+
+    @classmethod
+    def load(cls, slide_path: Path, slide_dimensions: tuple):
+        path = mask_path(slide_path)
+        if not path.exists():
+            return None
+        image = Image.open(path)
+        color = image.text.get("glass-color")
+        glass = tuple(int(color[i:i + 2], 16) for i in (0, 2, 4)) if color else None
+        return cls(np.asarray(image.convert("L")) > 0, slide_dimensions, glass, color is not None)
+
+    def has_tissue(self, x: float, y: float, width: float, height: float) -> bool:
+        left = max(0, int(x * self.scale_x) - 1)
+        top = max(0, int(y * self.scale_y) - 1)
+        right = int((x + width) * self.scale_x) + 2
+        bottom = int((y + height) * self.scale_y) + 2
+        return bool(self.mask[top:bottom, left:right].any())
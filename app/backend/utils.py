@@ -1,14 +1,70 @@
-import shutil, zipfile
+import os, shutil, tempfile, threading, zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def extract_zip(zip_path: Path, target_dir: Path):
+EXTRACT_WORKERS = int(os.environ.get("WSI_EXTRACT_WORKERS", min(8, os.cpu_count() or 4)))
+COPY_BUFFER = 8 * 1024 * 1024
+DISK_HEADROOM = 512 * 1024 * 1024
+
+
+class InsufficientDiskSpace(Exception):
+    pass
+
+
+def atomic_write(path: Path, data: bytes):
+    # Readers see either the old file or the complete new one; the temp name is unique per call
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def member_target(target_dir: Path, member: str) -> Path:
+    parts = Path(member).parts
+    target_path = target_dir / Path(*parts[1:]) if len(parts) > 1 else target_dir / Path(member)
+    if not target_path.resolve().is_relative_to(target_dir.resolve()):
+        raise ValueError(f"Unsafe path in archive: {member}")
+    return target_path
+
+
+def check_disk_space(zip_path: Path, target_dir: Path):
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        needed = sum(info.file_size for info in zip_ref.infolist())
+    free = shutil.disk_usage(target_dir).free
+    if needed + DISK_HEADROOM > free:
+        raise InsufficientDiskSpace(f"Extraction needs {needed} bytes, {free} available")
+
+
+def extract_zip(zip_path: Path, target_dir: Path, workers: int = EXTRACT_WORKERS):
     with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        for member in zip_ref.namelist():
-            parts = Path(member).parts
-            target_path = target_dir / Path(*parts[1:]) if len(parts) > 1 else target_dir / Path(member)
-            if member.endswith("/"):
-                target_path.mkdir(parents=True, exist_ok=True)
-            else:
-                target_path.parent.mkdir(parents=True, exist_ok=True)
-                with open(target_path, "wb") as outfile, zip_ref.open(member) as src:
-                    shutil.copyfileobj(src, outfile)
+        infos = zip_ref.infolist()
+    for info in infos:
+        if info.is_dir():
+            member_target(target_dir, info.filename).mkdir(parents=True, exist_ok=True)
+
+    # Each worker thread reads through its own ZipFile handle
+    local = threading.local()
+    handles = []
+
+    def extract(info):
+        zip_ref = getattr(local, "zip_ref", None)
+        if zip_ref is None:
+            zip_ref = local.zip_ref = zipfile.ZipFile(zip_path, "r")
+            handles.append(zip_ref)
+        target_path = member_target(target_dir, info.filename)
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(target_path, "wb") as outfile, zip_ref.open(info) as src:
+            shutil.copyfileobj(src, outfile, COPY_BUFFER)
+
+    # Largest members first so the big Data*.dat files start immediately
+    files = sorted((i for i in infos if not i.is_dir()), key=lambda i: i.file_size, reverse=True)
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="extract") as pool:
+            list(pool.map(extract, files))
+    finally:
+        for zip_ref in handles:
+            zip_ref.close()
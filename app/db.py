@@ -1,11 +1,12 @@
 # db.py
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, ForeignKey, DateTime, Index, event, inspect
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from datetime import datetime
+import os
 import uuid
 
-DATABASE_URL = "sqlite+aiosqlite:///./slides.db"
+DATABASE_URL = os.environ.get("WSI_DATABASE_URL", "sqlite+aiosqlite:///./slides.db")
 
 Base = declarative_base()
 
@@ -18,6 +19,15 @@ class Slide(Base):
     path = Column(String, nullable=False)
     filename = Column(String, nullable=False)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
+    pyramid_status = Column(String, nullable=True)
+    pyramid_all_levels = Column(Boolean, default=False)
+    pyramid_done = Column(Integer, default=0)
+    pyramid_total = Column(Integer, default=0)
+    pyramid_error = Column(String, nullable=True)
+    tissue_mask = Column(String, nullable=True)
+    thumbnail = Column(String, nullable=True)
+    pyramid_owner = Column(String, nullable=True)
+    pyramid_lease_expires = Column(DateTime, nullable=True)
 
     view_states = relationship("ViewState", back_populates="slide", cascade="all, delete")
 
@@ -34,11 +44,61 @@ class ViewState(Base):
 
     slide = relationship("Slide", back_populates="view_states")
 
+    # Serves newest-first listings and last_view per slide without a sort step
+    __table_args__ = (Index("ix_view_states_slide_saved", "slide_id", "saved_at"),)
+
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    filename = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="uploading")
+    size = Column(BigInteger, nullable=True)
+    received = Column(BigInteger, default=0)
+    pregenerate = Column(Boolean, default=False)
+    all_levels = Column(Boolean, default=False)
+    error = Column(String, nullable=True)
+    slide_id = Column(Integer, ForeignKey("slides.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    lease_owner = Column(String, nullable=True)
+    lease_expires = Column(DateTime, nullable=True)
+
+    slide = relationship("Slide")
+
 
 engine = create_async_engine(DATABASE_URL, echo=False, future=True)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def configure_sqlite(dbapi_conn, _):
+        # WAL lets readers proceed while a writer commits
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+def add_missing_columns(sync_conn):
+    # create_all only creates new tables, so columns and indexes added later are created here
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = column.type.compile(sync_conn.dialect)
+                sync_conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}")
+        indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(sync_conn)
+
+
 async def init_db():
     async with engine.begin() as conn:
+        await conn.run_sync(add_missing_columns)
         await conn.run_sync(Base.metadata.create_all)
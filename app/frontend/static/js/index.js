@@ -28,18 +28,65 @@ fileInput.addEventListener("change", async (e) => {
     }
 });
 
-async function uploadFile(file) {
-    const formData = new FormData();
-    formData.append("file", file);
+const CHUNK_SIZE = 32 * 1024 * 1024;
+const MAX_RETRIES = 5;
 
-    const res = await fetch("/upload", {
+async function uploadFile(file) {
+    if (!file.name.toLowerCase().endsWith(".zip")) {
+        alert("Upload must be a .zip containing .mrxs"); return;
+    }
+    const res = await fetch("/uploads", {
         method: "POST",
-        body: formData,
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ filename: file.name, size: file.size }),
     });
+    if (!res.ok) {
+        alert("Upload failed: " + (await res.text())); return;
+    }
+    const job = await res.json();
+
+    let offset = 0;
+    let retries = 0;
+    while (offset < file.size) {
+        dropzone.textContent = `Uploading... ${Math.floor(offset * 100 / file.size)}%`;
+        try {
+            const chunk = await fetch(`/uploads/${job.job_id}`, {
+                method: "PATCH",
+                headers: { "Upload-Offset": String(offset) },
+                body: file.slice(offset, offset + CHUNK_SIZE),
+            });
+            if (!chunk.ok && chunk.status !== 409) throw new Error(await chunk.text());
+            offset = Number(chunk.headers.get("Upload-Offset"));
+            retries = 0;
+        } catch (err) {
+            // Connection dropped: ask the server how much it kept and carry on from there
+            if (++retries > MAX_RETRIES) {
+                alert("Upload failed: " + err); return;
+            }
+            await new Promise(r => setTimeout(r, 1000 * retries));
+            const head = await fetch(`/uploads/${job.job_id}`, { method: "HEAD" }).catch(() => null);
+            if (head && head.ok) offset = Number(head.headers.get("Upload-Offset"));
+        }
+    }
+
+    const done = await fetch(`/uploads/${job.job_id}/complete`, { method: "POST" });
+    if (!done.ok) {
+        alert("Upload failed: " + (await done.text())); return;
+    }
+    await waitForIngest(job.job_id);
+}
 
-    if (res.redirected) {
-        window.location.href = res.url;
-    } else {
-        alert("Upload failed: " + (await res.text()));
+async function waitForIngest(jobId) {
+    dropzone.textContent = "Extracting...";
+    while (true) {
+        const res = await fetch(`/ingest/${jobId}`);
+        const status = await res.json();
+        if (status.status === "done") {
+            window.location.href = status.viewer_url; return;
+        }
+        if (status.status === "failed") {
+            alert("Upload failed: " + status.error); return;
+        }
+        await new Promise(r => setTimeout(r, 1000));
     }
 }
@@ -1,12 +1,18 @@
+// Tile encoder options (format, quality, subsampling) pass through from the page URL
+const tileParams = new URLSearchParams(
+    [...new URLSearchParams(window.location.search)].filter(([k]) => ["format","quality","subsampling"].includes(k))
+).toString();
+
 const viewer = OpenSeadragon({
     id:"openseadragon",
     prefixUrl:"https://openseadragon.github.io/openseadragon/images/",
-    tileSources:`/dzi/${slide_uuid}/${filename}`
+    tileSources:`/dzi/${slide_uuid}/${filename}.dzi` + (tileParams ? `?${tileParams}` : "")
 });
 
 document.getElementById("saveBtn").addEventListener("click", saveView);
 document.getElementById("loadBtn").addEventListener("click", loadLastView);
 document.getElementById("loadSelectedBtn").addEventListener("click", loadSelectedView);
+document.getElementById("exportAllBtn").addEventListener("click", exportAllViews);
 
 async function saveView() {
     const vp = viewer.viewport;
@@ -16,23 +22,52 @@ async function saveView() {
         center_y: vp.getCenter().y,
         rotation: vp.getRotation()
     };
-    const canvas = await html2canvas(document.getElementById("openseadragon"));
-    const dataUrl = canvas.toDataURL("image/jpeg",0.9);
-    const body = { snapshot:dataUrl, viewState };
     const res = await fetch(`/save_view/${slide_uuid}`, {
         method:"POST", headers:{"Content-Type":"application/json"},
-        body:JSON.stringify(body)
+        body:JSON.stringify({ viewState })
     });
     if(!res.ok) {
         alert("Save failed: " + (await res.text())); return;
     }
+    await exportRegions([{ ...viewState, aspect: viewerAspect() }], "snapshot.zip");
+    await fetchViews(); // refresh dropdown
+}
+
+async function exportAllViews() {
+    const options = Array.from(document.getElementById("viewSelect").options);
+    if (!options.length) { alert("No saved views"); return; }
+    const aspect = viewerAspect();
+    const regions = options.map(o => ({ view_id: JSON.parse(o.value).id, aspect }));
+    // The server caps regions per export, so larger sets download as several archives
+    const batches = Math.ceil(regions.length / maxExportRegions);
+    for (let i = 0; i < batches; i++) {
+        const batch = regions.slice(i * maxExportRegions, (i + 1) * maxExportRegions);
+        const name = batches > 1 ? `views_${i + 1}.zip` : "views.zip";
+        if (!await exportRegions(batch, name)) return;
+    }
+}
+
+function viewerAspect() {
+    const el = document.getElementById("openseadragon");
+    return el.clientWidth / el.clientHeight;
+}
+
+async function exportRegions(regions, downloadName) {
+    const maxSize = Number(document.getElementById("exportSize").value);
+    const res = await fetch(`/export/${slide_uuid}`, {
+        method:"POST", headers:{"Content-Type":"application/json"},
+        body:JSON.stringify({ regions, max_size: maxSize || null })
+    });
+    if(!res.ok) {
+        alert("Export failed: " + (await res.text())); return false;
+    }
     const blob = await res.blob();
     const url = window.URL.createObjectURL(blob);
     const a = document.createElement("a");
-    a.href=url; a.download="snapshot.jpg";
+    a.href=url; a.download=downloadName;
     document.body.appendChild(a); a.click(); a.remove();
     window.URL.revokeObjectURL(url);
-    await fetchViews(); // refresh dropdown
+    return true;
 }
 
 async function loadLastView() {
@@ -46,9 +81,10 @@ async function loadLastView() {
 }
 
 async function fetchViews() {
-    const res = await fetch(`/all_views/${slide_uuid}`);
+    // Only the most recent page; older views stay on the server until asked for
+    const res = await fetch(`/all_views/${slide_uuid}?limit=100`);
     if (!res.ok) return;
-    const views = await res.json();
+    const views = (await res.json()).items;
     const select = document.getElementById("viewSelect");
     select.innerHTML = "";
     views.forEach(v => {
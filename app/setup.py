@@ -1,4 +1,7 @@
+import asyncio
+import logging
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from db import init_db
 from backend.routes_root import router as root_router
@@ -6,19 +9,64 @@ from backend.routes_upload import router as upload_router
 from backend.routes_viewer import router as viewer_router
 from backend.routes_dzi import router as dzi_router
 from backend.routes_views import router as views_router
+from backend.routes_pyramid import router as pyramid_router
+from backend.routes_export import router as export_router
+from backend.routes_metrics import router as metrics_router
+from backend.slide_cache import registry
+from backend.tile_store import tile_store
+from backend.render_pool import render_pool
+from backend import pyramid, ingest, export
+from backend.metrics import MetricsMiddleware, sample_loop_lag, start_profiler, stop_profiler
+
+SWEEP_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+async def sweep_caches():
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        registry.sweep()
+        if tile_store is not None:
+            await run_in_threadpool(tile_store.evict)
+        # Picks up jobs whose lease lapsed because the worker running them died
+        try:
+            await pyramid.resume_jobs()
+            await ingest.resume_jobs()
+        except Exception:
+            logger.exception("Could not resume background jobs")
 
 def create_app() -> FastAPI:
     app = FastAPI(title="WSI Viewer API")
     app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
+    app.add_middleware(MetricsMiddleware)
 
     @app.on_event("startup")
     async def startup_event():
         await init_db()
+        app.state.sweeper = asyncio.create_task(sweep_caches())
+        app.state.loop_lag = asyncio.create_task(sample_loop_lag())
+        start_profiler()
+        await pyramid.resume_jobs()
+        await ingest.resume_jobs()
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        app.state.sweeper.cancel()
+        app.state.loop_lag.cancel()
+        stop_profiler()
+        render_pool.shutdown()
+        pyramid.shutdown()
+        ingest.shutdown()
+        export.shutdown()
 
     app.include_router(root_router)
     app.include_router(upload_router)
     app.include_router(viewer_router)
     app.include_router(dzi_router)
     app.include_router(views_router)
+    app.include_router(pyramid_router)
+    app.include_router(export_router)
+    app.include_router(metrics_router)
 
     return app
@@ -0,0 +1,75 @@
+"""Synthetic pyramidal TIFF slides for offline benchmarks.
+
+The image is procedural: a few smooth tissue blobs with stain-like texture on
+a near-white glass background, so OpenSlide sees a realistic mix of tissue
+and blank tiles without any patient data.
+"""
+import math
+
+import numpy as np
+import tifffile
+
+TILE = 256
+BACKGROUND = (242, 242, 240)
+
+
+def tissue_blobs(width: int, height: int, seed: int, count: int = 6) -> list:
+    rng = np.random.default_rng(seed)
+    blobs = []
+    for _ in range(count):
+        cx, cy = rng.uniform(0.15, 0.85) * width, rng.uniform(0.15, 0.85) * height
+        radius = rng.uniform(0.08, 0.22) * min(width, height)
+        blobs.append((cx, cy, radius))
+    return blobs
+
+
+def render_tile(x0: int, y0: int, w: int, h: int, scale: float, blobs: list, seed: int) -> np.ndarray:
+    # Coordinates are evaluated in level-0 space so every level shows the same picture
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+    xs = (xs + x0) * scale
+    ys = (ys + y0) * scale
+    density = np.zeros((h, w), np.float32)
+    for cx, cy, radius in blobs:
+        density = np.maximum(density, 1 - np.hypot(xs - cx, ys - cy) / radius)
+    tissue = density > 0
+
+    texture = np.sin(xs / 37.0) * np.cos(ys / 53.0) + np.sin((xs + ys) / 11.0) * 0.5
+    rng = np.random.default_rng(seed + x0 * 7919 + y0 * 104729 + int(scale))
+    noise = rng.normal(0, 12, (h, w)).astype(np.float32)
+
+    tile = np.empty((h, w, 3), np.uint8)
+    tile[:] = BACKGROUND
+    shade = np.clip(texture * 30 + noise, -60, 60)
+    stain = np.stack([190 + shade, 110 + shade * 0.8, 170 + shade * 0.6], axis=-1)
+    tile[tissue] = np.clip(stain[tissue], 0, 255).astype(np.uint8)
+    return tile
+
+
+def level_tiles(width: int, height: int, scale: float, blobs: list, seed: int):
+    for y0 in range(0, height, TILE):
+        for x0 in range(0, width, TILE):
+            tile = np.empty((TILE, TILE, 3), np.uint8)
+            tile[:] = BACKGROUND
+            w, h = min(TILE, width - x0), min(TILE, height - y0)
+            tile[:h, :w] = render_tile(x0, y0, w, h, scale, blobs, seed)
+            yield tile
+
+
+def write_slide(path, width: int, height: int, seed: int = 0, compression: str = "zlib") -> dict:
+    """Write a tiled multi-resolution TIFF that OpenSlide opens as a generic-tiff slide."""
+    blobs = tissue_blobs(width, height, seed)
+    levels = max(1, int(math.ceil(math.log2(max(width, height) / 1024))) + 1)
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        for level in range(levels):
+            scale = 2 ** level
+            w, h = max(1, width // scale), max(1, height // scale)
+            tif.write(
+                level_tiles(w, h, scale, blobs, seed),
+                shape=(h, w, 3),
+                dtype=np.uint8,
+                tile=(TILE, TILE),
+                photometric="rgb",
+                compression=compression,
+                subfiletype=0 if level == 0 else 1,
+            )
+    return {"width": width, "height": height, "levels": levels, "seed": seed, "compression": compression}
@@ -0,0 +1,314 @@
+"""Reproducible tile-serving benchmark.
+
+Generates a synthetic pyramidal slide, registers it through the Slide model
+and replays OpenSeadragon-style pan/zoom sessions against the app built by
+setup.create_app, cold and warm, at several concurrency levels.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/tile_serving.py --size 32768x24576 --concurrency 1,8,32 --output bench.json
+    python benchmarks/tile_serving.py --compare bench.json --output bench-new.json
+
+Everything runs in-process against temporary directories, so no real slides
+or databases are touched.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "app"
+TILE = 256
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="16384x12288", help="level-0 size of the synthetic slide, WxH")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated in-flight request limits")
+    parser.add_argument("--sessions", type=int, default=4, help="simulated viewer sessions per run")
+    parser.add_argument("--steps", type=int, default=12, help="pan/zoom steps per session")
+    parser.add_argument("--viewport", default="1280x800", help="simulated viewer size, WxH")
+    parser.add_argument("--format", default="jpeg", choices=["jpeg", "webp", "png"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compression", default="zlib", help="TIFF compression for the synthetic slide")
+    parser.add_argument("--tissue-mask", action="store_true", help="build the tissue mask before running")
+    parser.add_argument("--workdir", type=Path, help="keep generated files here instead of a temp dir")
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="print deltas against an earlier JSON result")
+    return parser.parse_args()
+
+
+def parse_size(value: str) -> tuple:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def configure_environment(workdir: Path):
+    # Must run before any app module is imported, since they read these at import time
+    os.environ["WSI_DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir / 'bench.db'}"
+    os.environ["WSI_SLIDES_DIR"] = str(workdir / "slides")
+    os.environ["WSI_TILE_STORE_INDEX"] = str(workdir / "tilecache.db")
+    os.chdir(APP_DIR)
+    sys.path.insert(0, str(APP_DIR))
+    sys.path.insert(0, str(ROOT / "benchmarks"))
+
+
+class Viewer:
+    """Mimics which tiles OpenSeadragon requests while a user pans and zooms."""
+
+    def __init__(self, width: int, height: int, viewport: tuple, rng: random.Random):
+        self.width, self.height = width, height
+        self.vw, self.vh = viewport
+        self.rng = rng
+        self.max_level = math.ceil(math.log2(max(width, height)))
+        self.home_scale = min(self.vw / width, self.vh / height)
+        self.scale = self.home_scale
+        self.cx, self.cy = width / 2, height / 2
+
+    def visible_tiles(self) -> list:
+        # Pick the DZI level whose resolution just exceeds the screen, like OpenSeadragon does
+        level = min(self.max_level, self.max_level + math.ceil(math.log2(self.scale)))
+        level_scale = 2 ** (level - self.max_level)
+        half_w, half_h = self.vw / self.scale / 2, self.vh / self.scale / 2
+        left, right = max(0, self.cx - half_w), min(self.width, self.cx + half_w)
+        top, bottom = max(0, self.cy - half_h), min(self.height, self.cy + half_h)
+        cols = range(int(left * level_scale) // TILE, int(math.ceil(right * level_scale / TILE)))
+        rows = range(int(top * level_scale) // TILE, int(math.ceil(bottom * level_scale / TILE)))
+        return [(level, col, row) for row in rows for col in cols]
+
+    def step(self):
+        action = self.rng.choices(["zoom_in", "zoom_out", "pan"], weights=[4, 2, 4])[0]
+        if action == "zoom_in" and self.scale < 1:
+            self.scale = min(1.0, self.scale * 2)
+            self.cx += self.rng.uniform(-0.25, 0.25) * self.vw / self.scale
+            self.cy += self.rng.uniform(-0.25, 0.25) * self.vh / self.scale
+        elif action == "zoom_out" and self.scale > self.home_scale:
+            self.scale = max(self.home_scale, self.scale / 2)
+        else:
+            self.cx += self.rng.choice([-0.5, 0.5]) * self.vw / self.scale
+            self.cy += self.rng.choice([-0.3, 0, 0.3]) * self.vh / self.scale
+        self.cx = min(max(self.cx, 0), self.width)
+        self.cy = min(max(self.cy, 0), self.height)
+
+
+def build_frames(width: int, height: int, viewport: tuple, sessions: int, steps: int, seed: int) -> list:
+    # Each frame is the batch of tiles the viewer asks for after one interaction
+    frames = []
+    for session in range(sessions):
+        viewer = Viewer(width, height, viewport, random.Random(seed * 1000 + session))
+        frames.append(viewer.visible_tiles())
+        for _ in range(steps):
+            viewer.step()
+            frames.append(viewer.visible_tiles())
+    return frames
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def process_usage() -> dict:
+    with open("/proc/self/statm") as statm:
+        rss_pages = int(statm.read().split()[1])
+    return {
+        "rss_mb": rss_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "open_fds": len(os.listdir("/proc/self/fd")),
+    }
+
+
+async def sample_usage(peaks: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        usage = process_usage()
+        for name, value in usage.items():
+            peaks[name] = max(peaks.get(name, 0), value)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.05)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_frames(client, base: str, frames: list, fmt: str, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+    bytes_served = 0
+
+    async def fetch(level, col, row):
+        nonlocal bytes_served
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(f"{base}_files/{level}/{col}_{row}.{fmt}")
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            bytes_served += len(response.content)
+
+    peaks = {}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_usage(peaks, stop))
+    started = time.perf_counter()
+    for frame in frames:
+        await asyncio.gather(*(fetch(*tile) for tile in frame))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    ok = statuses.get(200, 0)
+    return {
+        "requests": len(latencies),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "seconds": elapsed,
+        "tiles_per_second": ok / elapsed if elapsed else 0.0,
+        "bytes": bytes_served,
+        "latency_ms": {
+            "p50": 1000 * percentile(latencies, 0.50),
+            "p95": 1000 * percentile(latencies, 0.95),
+            "p99": 1000 * percentile(latencies, 0.99),
+            "max": 1000 * max(latencies, default=0.0),
+        },
+        "peak": peaks,
+        "after": process_usage(),
+    }
+
+
+def reset_caches(workdir: Path):
+    from backend.slide_cache import registry
+    from backend.tile_cache import tile_cache
+    from backend import tile_store as store_module
+
+    tile_cache.clear()
+    registry.invalidate_dir(workdir)
+    store = store_module.tile_store
+    if store is not None:
+        shutil.rmtree(store.root, ignore_errors=True)
+        store._db().execute("DELETE FROM tiles")
+
+
+async def register_slide(slide_path: Path, build_mask: bool) -> str:
+    from db import AsyncSessionLocal, Slide
+    from backend.ingest import build_preview
+    from backend.tissue import build_mask as build_tissue_mask
+
+    mask = build_preview(build_tissue_mask, slide_path) if build_mask else None
+    async with AsyncSessionLocal() as db:
+        slide = Slide(name=slide_path.stem, path=str(slide_path.parent), filename=slide_path.name, tissue_mask=mask)
+        db.add(slide)
+        await db.commit()
+        await db.refresh(slide)
+        return slide.uuid
+
+
+async def benchmark(args, workdir: Path) -> dict:
+    import httpx
+    from synthetic import write_slide
+    from setup import create_app
+
+    width, height = parse_size(args.size)
+    slide_dir = Path(os.environ["WSI_SLIDES_DIR"]) / "synthetic"
+    slide_dir.mkdir(parents=True, exist_ok=True)
+    slide_path = slide_dir / f"synthetic_{width}x{height}_{args.seed}.tiff"
+    started = time.perf_counter()
+    if slide_path.exists():
+        slide_info = {"width": width, "height": height, "seed": args.seed, "reused": True}
+    else:
+        slide_info = write_slide(slide_path, width, height, args.seed, args.compression)
+    slide_info["generate_seconds"] = time.perf_counter() - started
+
+    app = create_app()
+    await app.router.startup()
+    try:
+        slide_uuid = await register_slide(slide_path, args.tissue_mask)
+        frames = build_frames(width, height, parse_size(args.viewport), args.sessions, args.steps, args.seed)
+        base = f"/dzi/{slide_uuid}/{slide_path.name}"
+        transport = httpx.ASGITransport(app=app)
+        runs = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                reset_caches(workdir)
+                for phase in ("cold", "warm"):
+                    result = await run_frames(client, base, frames, args.format, concurrency)
+                    result.update({"phase": phase, "concurrency": concurrency})
+                    runs.append(result)
+                    print(
+                        f"{phase:>4} c={concurrency:<3} {result['tiles_per_second']:8.1f} tiles/s  "
+                        f"p50 {result['latency_ms']['p50']:7.2f} ms  p95 {result['latency_ms']['p95']:7.2f} ms  "
+                        f"p99 {result['latency_ms']['p99']:7.2f} ms  rss {result['peak'].get('rss_mb', 0):6.1f} MB  "
+                        f"fds {result['peak'].get('open_fds', 0)}",
+                        flush=True,
+                    )
+    finally:
+        await app.router.shutdown()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+            "slide": slide_info,
+            "frames": len(frames),
+            "tiles_per_pass": sum(len(f) for f in frames),
+        },
+        "runs": runs,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    before = {(r["phase"], r["concurrency"]): r for r in previous["runs"]}
+    print(f"\ncompared with {previous['meta'].get('commit') or 'previous run'}:")
+    for run in current["runs"]:
+        old = before.get((run["phase"], run["concurrency"]))
+        if old is None:
+            continue
+        tps = run["tiles_per_second"] / old["tiles_per_second"] - 1 if old["tiles_per_second"] else 0.0
+        p95 = run["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1 if old["latency_ms"]["p95"] else 0.0
+        print(f"{run['phase']:>4} c={run['concurrency']:<3} tiles/s {tps:+7.1%}  p95 {p95:+7.1%}")
+
+
+def main():
+    args = parse_args()
+    # Resolve user paths now; configure_environment changes into the app directory
+    args.output = args.output and args.output.resolve()
+    args.compare = args.compare and args.compare.resolve()
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="wsi-bench-"))
+    workdir = workdir.resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    configure_environment(workdir)
+    try:
+        results = asyncio.run(benchmark(args, workdir))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), results)
+
+
+if __name__ == "__main__":
+    main()